@@ -1,18 +1,32 @@
+import queue
 import threading
-import time
 
 import customtkinter as ctk
-from tkinter import messagebox, filedialog, ttk
+from tkinter import messagebox, filedialog
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
 from PIL import Image
-from draw_based_on_models import draw_crack_path
+from draw_based_on_models import PLOT_LIMIT, StopConditions, draw_specimen, iter_points, path_coordinates, plot_path
+from ensemble import ENSEMBLE, ensemble_paths, plot_envelope, predict_ensemble_general
+from instrumentation import collect
+from model_registry import registry
 from predictions_based_on_models import predict_Y1, predict_angle, predict_Y2, predict_T, predict_J
 
 # Configure the customtkinter library
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 
+# How often the crack path plot is updated while it is being calculated
+REDRAW_INTERVAL_MS = 100
+
+STOP_REASONS = {
+    "ligament_exit": "the crack left the specimen",
+    "hole": "the crack reached a pin hole",
+    "plot_window": "the crack left the plotted region",
+    "max_extension": "the maximum crack extension was reached",
+    "max_steps": "the maximum number of steps was reached",
+}
+
 
 class SplashScreen:
     def __init__(self, root):
@@ -73,7 +87,6 @@ class CrackPathApp:
         self.root = root
         self.entries = {}
         self.model_type_var = ctk.StringVar(value="DNN")
-        self.spinner_running = False
 
         self.create_input_screen()
 
@@ -120,7 +133,7 @@ class CrackPathApp:
         model_type_label = ctk.CTkLabel(model_type_frame, text="Model Type:", anchor="w")
         model_type_label.pack(side="left", padx=5)
 
-        for text in ["DNN", "XGBoost", "TabNet"]:
+        for text in ["DNN", "XGBoost", "TabNet", ENSEMBLE]:
             model_radio = ctk.CTkRadioButton(
                 model_type_frame, text=text, variable=self.model_type_var, value=text
             )
@@ -150,49 +163,110 @@ class CrackPathApp:
             messagebox.showerror("Input Error", "Please enter valid numeric values for all fields.")
             return
 
-        def run_task():
-            try:
-                fig = draw_crack_path(*values, chosen_model, True)
-
-                def update_ui():
-                    self.clear_window()
-                    canvas = FigureCanvasTkAgg(fig, master=self.root)
-                    canvas.draw()
-                    canvas.get_tk_widget().pack(pady=20)
-
-                    button_frame = ctk.CTkFrame(self.root)
-                    button_frame.pack(pady=20)
-
-                    export_button = ctk.CTkButton(button_frame, text="Export Plot", command=lambda: self.export_plot(fig), width=150)
-                    export_button.pack(side="left", padx=10)
+        length, width, vertical_distance, horizontal_distance, diameter, precrack, theta, increment = values
+        self.clear_window()
 
-                    back_button = ctk.CTkButton(button_frame, text="Back", command=self.create_input_screen, width=150)
-                    back_button.pack(side="right", padx=10)
+        # The specimen is drawn at once and the path grows on it as the points arrive
+        fig, ax = draw_specimen(length, width, vertical_distance, horizontal_distance, diameter, precrack, chosen_model)
+        points = [(0, 0), (precrack, 0)]
+        path_line = plot_path(ax, points, width, length)
+        canvas = FigureCanvasTkAgg(fig, master=self.root)
+        canvas.draw()
+        canvas.get_tk_widget().pack(pady=20)
 
-                self.root.after(0, update_ui)
+        status_label = ctk.CTkLabel(self.root, text="Calculating the crack path...")
+        status_label.pack()
 
-            except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {e}")
+        cancel = threading.Event()
+        new_points = queue.Queue()
+        # Points beyond the plotted region or inside a pin hole are not computed
+        stop = StopConditions(vertical_distance, horizontal_distance, diameter, x_limit=PLOT_LIMIT)
 
-            finally:
-                self.spinner_running = False
+        def back():
+            cancel.set()
+            self.create_input_screen()
 
-        def show_spinner():
-            while self.spinner_running:
-                self.root.update_idletasks()
-                time.sleep(0.1)
+        button_frame = ctk.CTkFrame(self.root)
+        button_frame.pack(pady=20)
 
-        self.clear_window()
-        self.spinner_running = True
+        cancel_button = ctk.CTkButton(button_frame, text="Cancel", command=cancel.set, width=150)
+        cancel_button.pack(side="left", padx=10)
 
-        self.spinner_label = ctk.CTkLabel(self.root, text="Calculating the crack path...", font=("Roboto", 24, "bold"))
-        self.spinner_label.pack(padx=40, pady=40)
+        export_button = ctk.CTkButton(button_frame, text="Export Plot", command=lambda: self.export_plot(fig), width=150,
+                                      state="disabled")
+        export_button.pack(side="left", padx=10)
 
-        self.progress = ttk.Progressbar(self.root, orient="horizontal", mode="indeterminate")
-        self.progress.pack(pady=20, padx=60, fill="x")
-        self.progress.start()
+        back_button = ctk.CTkButton(button_frame, text="Back", command=back, width=150)
+        back_button.pack(side="right", padx=10)
 
-        threading.Thread(target=show_spinner, daemon=True).start()
+        def run_task():
+            try:
+                with collect() as stats:
+                    if chosen_model == ENSEMBLE:
+                        # All methods are computed concurrently and drawn together at the end
+                        new_points.put(("ensemble", ensemble_paths(points[0], points[1], theta, width, length,
+                                                                   increment, cancel=cancel)))
+                        reason = None
+                    else:
+                        path = iter_points(points[0], points[1], theta, width, length, increment, chosen_model,
+                                           cancel=cancel, stop=stop)
+                        for _ in range(2):
+                            next(path)
+                        while True:
+                            try:
+                                new_points.put(("point", next(path)))
+                            except StopIteration as end:
+                                reason = end.value
+                                break
+                new_points.put(("done", (stats.summary(), reason)))
+            except Exception as e:
+                new_points.put(("error", e))
+
+        def update_plot():
+            if not canvas.get_tk_widget().winfo_exists():
+                return
+            finished = None
+            received = False
+            while True:
+                try:
+                    item_type, item = new_points.get_nowait()
+                except queue.Empty:
+                    break
+                if item_type == "point":
+                    points.append(item)
+                    received = True
+                elif item_type == "ensemble":
+                    path_line.set_data([], [])
+                    plot_envelope(ax, item, width, length)
+                    canvas.draw_idle()
+                else:
+                    finished = item_type, item
+            # Redraw once for all points received since the last update
+            if received:
+                path_line.set_data(*path_coordinates(points, width, length))
+                canvas.draw_idle()
+            if finished is None:
+                self.root.after(REDRAW_INTERVAL_MS, update_plot)
+                return
+
+            cancel_button.configure(state="disabled")
+            export_button.configure(state="normal")
+            finished_type, finished = finished
+            if finished_type == "error":
+                status_label.configure(text="The crack path could not be calculated.")
+                messagebox.showerror("Error", f"An error occurred: {finished}")
+            elif cancel.is_set():
+                status_label.configure(text=f"Cancelled after {len(points) - 2} steps.")
+            else:
+                summary, reason = finished
+                times = summary["time_by_category"]
+                status_label.configure(
+                    text=f"{summary['steps']} steps, model loading {times.get('load', 0):.2f} s, "
+                         f"inference {times.get('inference', 0):.2f} s, plotting {times.get('plotting', 0):.2f} s"
+                         + (f"; stopped because {STOP_REASONS[reason]}" if reason in STOP_REASONS else "")
+                )
+
+        self.root.after(REDRAW_INTERVAL_MS, update_plot)
         threading.Thread(target=run_task, daemon=True).start()
 
     def export_plot(self, fig):
@@ -258,7 +332,7 @@ class FractureParamApp:
         model_label = ctk.CTkLabel(model_frame, text="Model Type:", anchor="w", width=150)
         model_label.pack(side="left", padx=20)
 
-        for text in ["DNN", "XGBoost", "TabNet"]:
+        for text in ["DNN", "XGBoost", "TabNet", ENSEMBLE]:
             model_radio = ctk.CTkRadioButton(model_frame, text=text, variable=self.model_var, value=text)
             model_radio.pack(side="left", padx=5)
 
@@ -291,21 +365,26 @@ class FractureParamApp:
             messagebox.showerror("Input Error", "Please enter valid numeric values for all fields.")
             return
 
-        versions = {
-            "YI": {'XGBoost':1, 'DNN':1, 'TabNet':5},
-            "YII": {'XGBoost':1, 'DNN':4, 'TabNet':6},
-            "angle": {'XGBoost':8, 'DNN':5, 'TabNet':6},
-            "T": {'XGBoost':3, 'DNN':5, 'TabNet':6},
-            "J": {'XGBoost':1, 'DNN':2, 'TabNet':6},
-        }
-
-        results = {
-            "YI": predict_Y1(width, length, x/width, y/length, beta, theta, model, versions["YI"][model]),
-            "YII": predict_Y2(width, length, x/width, y/length, beta, theta, model, versions["YII"][model]),
-            "fracture angle": predict_angle(width, length, x/width, y/length, beta, theta, model, versions["angle"][model]),
-            "J-Integral": predict_J(width, length, x/width, y/length, beta, theta, model, versions["J"][model]),
-            "T-Stress": predict_T(width, length, x/width, y/length, beta, theta, model, versions["T"][model]),
-        }
+        if model == ENSEMBLE:
+            # Mean and spread over all methods whose models are available
+            try:
+                ensemble = predict_ensemble_general(width, length, x/width, y/length, beta, theta)
+            except FileNotFoundError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            results = {
+                name: f"{round(ensemble[kind]['mean'], 2)} ± {round(ensemble[kind]['std'], 2)}"
+                for name, kind in [("YI", "Y1"), ("YII", "Y2"), ("fracture angle", "angle"), ("J-Integral", "J"),
+                                   ("T-Stress", "T")]
+            }
+        else:
+            results = {
+                "YI": predict_Y1(width, length, x/width, y/length, beta, theta, model),
+                "YII": predict_Y2(width, length, x/width, y/length, beta, theta, model),
+                "fracture angle": predict_angle(width, length, x/width, y/length, beta, theta, model),
+                "J-Integral": predict_J(width, length, x/width, y/length, beta, theta, model),
+                "T-Stress": predict_T(width, length, x/width, y/length, beta, theta, model),
+            }
 
         self.clear_window()
 
@@ -322,7 +401,7 @@ class FractureParamApp:
             key_label = ctk.CTkLabel(frame, text=f"{key}:", width=100, anchor="w")
             key_label.pack(side="left", padx=10)
 
-            value_label = ctk.CTkLabel(frame, text=f"{round(float(value),2)}", width=100, anchor="e")
+            value_label = ctk.CTkLabel(frame, text=value if isinstance(value, str) else f"{round(float(value),2)}", width=100, anchor="e")
             value_label.pack(side="right", padx=10)
 
         button_frame = ctk.CTkFrame(self.root)
@@ -353,6 +432,8 @@ class FractureParamApp:
 
 
 if __name__ == "__main__":
+    # Load the DNN models in the background while the splash screen is shown
+    threading.Thread(target=registry.warm_up, daemon=True).start()
     root = ctk.CTk()
     SplashScreen(root)
     root.mainloop()
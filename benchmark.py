@@ -0,0 +1,180 @@
+"""Benchmarks of the prediction, path generation and rendering hot paths.
+
+Run the suite and store the results::
+
+    python benchmark.py run --output baseline.json
+
+and check a later run against them::
+
+    python benchmark.py run --output current.json --baseline baseline.json --threshold 0.2
+
+Every benchmark uses pinned inputs and runs offline on the CPU; models are
+loaded before timing starts. Method/backend combinations whose model files
+are missing are skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from model_registry import BACKENDS, KINDS, METHODS, model_path
+from numpy_inference import has_network
+from surrogate_grid import surrogate_path
+
+DEFAULT_INCREMENTS = (2, 1, 0.5)
+
+
+def _time(function, repeat):
+    function()  # warm-up, also loads the models
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return {'median_s': statistics.median(timings), 'min_s': min(timings), 'repeat': repeat}
+
+
+def _configurations(methods, backends):
+    for method in methods:
+        for backend in backends:
+            if backend == 'numpy' and method != 'DNN':
+                continue
+            yield method, backend
+
+
+def run_benchmarks(methods=('DNN',), backends=('keras', 'numpy'), increments=DEFAULT_INCREMENTS, batch_size=10000,
+                   repeat=5, render=True):
+    from draw_based_on_models import generate_points
+    from predictions_based_on_models import predict_batch, predict_general
+
+    rng = np.random.default_rng(0)
+    # Inputs in the training range of (beta, theta, x/W, y/L)
+    points = rng.uniform([0, 0, 0.05, -0.24], [90, 90, 0.9, 0], size=(batch_size, 4))
+    results = {}
+    available = []
+    for method, backend in _configurations(methods, backends):
+        prefix = f'{method}/{backend}'
+        if backend == 'numpy':
+            present = all(has_network(kind) for kind in KINDS)
+        else:
+            artifact_path = surrogate_path if backend == 'surrogate' else model_path
+            present = all(os.path.exists(artifact_path(kind, method)) for kind in KINDS)
+        if not present:
+            results[f'{prefix}/skipped'] = {'reason': 'model files missing'}
+            continue
+        available.append((method, backend))
+        results[f'{prefix}/single_point'] = _time(
+            lambda: predict_general(42, 71.4, 21, -5, 80, 45, method, 'angle', backend=backend), repeat)
+        timing = _time(lambda: predict_batch(points, method=method, backend=backend), repeat)
+        timing['rows_per_s'] = batch_size * len(KINDS) / timing['median_s']
+        results[f'{prefix}/batch_{batch_size}'] = timing
+        for increment in increments:
+            results[f'{prefix}/path_da_{increment}'] = _time(
+                lambda: generate_points((0, 0), (19, 0), 45, 42, 71.4, increment, method, backend), repeat)
+
+    if render and available:
+        # Rendering does not depend on the backend; use the fastest one available
+        method, backend = available[-1]
+        import matplotlib
+
+        matplotlib.use('Agg')
+        from matplotlib import pyplot as plt
+
+        from draw_based_on_models import draw_crack_path
+
+        def draw():
+            fig = draw_crack_path(71.4, 42, 50.4, 25.2, 6.3, 19, 45, 2, method, True, backend)
+            fig.canvas.draw()
+            plt.close(fig)
+
+        results[f'{method}/{backend}/render'] = _time(draw, repeat)
+
+        from draw_based_on_models import generate_points_batch
+        from renderer import SpecimenRenderer
+
+        theta = np.linspace(0, 90, 1000)
+        paths, lengths, _ = generate_points_batch((0, 0), (19, 0), theta, 42, 71.4, 1, method, backend)
+        paths = [points[:n] for points, n in zip(paths, lengths)]
+        renderer = SpecimenRenderer(71.4, 42, 50.4, 25.2, 6.3, 19, method)
+        results[f'{method}/{backend}/render_overlay_1000'] = _time(lambda: renderer.render(paths), repeat)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return the benchmarks whose median time grew by more than ``threshold`` relative to the baseline."""
+    regressions = {}
+    for name, timing in results.items():
+        reference = baseline.get(name)
+        if reference is None or 'median_s' not in timing or 'median_s' not in reference:
+            continue
+        ratio = timing['median_s'] / reference['median_s']
+        if ratio > 1 + threshold:
+            regressions[name] = {'baseline_s': reference['median_s'], 'current_s': timing['median_s'],
+                                 'ratio': ratio}
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help='run the benchmarks')
+    run.add_argument('--methods', nargs='+', choices=METHODS, default=['DNN'])
+    run.add_argument('--backends', nargs='+', choices=BACKENDS, default=['keras', 'numpy'])
+    run.add_argument('--increments', nargs='+', type=float, default=list(DEFAULT_INCREMENTS))
+    run.add_argument('--batch-size', type=int, default=10000)
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--no-render', action='store_true', help='skip the figure rendering benchmark')
+    run.add_argument('--output', help='JSON file for the results (default: standard output)')
+    run.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    run.add_argument('--threshold', type=float, default=0.2,
+                     help='relative slowdown that counts as a regression (default: 0.2)')
+    compare_parser = subparsers.add_parser('compare', help='compare two stored runs')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = {'environment': environment(),
+                  'results': run_benchmarks(args.methods, args.backends, args.increments, args.batch_size,
+                                            args.repeat, not args.no_render)}
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as file:
+                file.write(output + '\n')
+        else:
+            print(output)
+        baseline_path = args.baseline
+    else:
+        with open(args.current) as file:
+            report = json.load(file)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+        for name, regression in regressions.items():
+            print(f'REGRESSION {name}: {regression["baseline_s"]:.4g} s -> {regression["current_s"]:.4g} s '
+                  f'({regression["ratio"]:.2f}x)', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""Headless command line interface for the CTS models.
+
+Examples::
+
+    python -m cts predict --point 1 45 0.5 -0.1 --kinds Y1 Y2 --format csv
+    python -m cts path --theta 30 --increment 1 --output path.json
+
+Nothing from the GUI or matplotlib is imported, and model backends are only
+loaded when a prediction actually needs them.
+"""
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import csv
+import json
+import sys
+from contextlib import ExitStack
+
+import numpy as np
+
+import instrumentation
+from model_registry import BACKENDS, KINDS, METHODS
+from prediction_cache import DEFAULT_CACHE_PATH
+
+
+def _write(rows, header, output_format, output):
+    file = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        if output_format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+        else:
+            json.dump([dict(zip(header, row)) for row in rows], file, indent=2)
+            file.write('\n')
+    finally:
+        if output:
+            file.close()
+
+
+def _read_points(path, columns=4):
+    with open(path, newline='') as file:
+        rows = [row for row in csv.reader(file) if row]
+    # Skip a header line if there is one
+    try:
+        float(rows[0][0])
+    except ValueError:
+        rows = rows[1:]
+    return np.array(rows, dtype=np.float64).reshape(-1, columns)
+
+
+def run_predict(args):
+    from predictions_based_on_models import predict_batch
+
+    points = []
+    if args.input:
+        points.append(_read_points(args.input))
+    if args.point:
+        points.append(np.array(args.point, dtype=np.float64))
+    if not points:
+        raise SystemExit('predict: give at least one --point or an --input file')
+    points = np.concatenate(points)
+    results = predict_batch(points, args.kinds, args.method, backend=args.backend)
+    header = ['beta', 'theta', 'x/W', 'y/L'] + list(args.kinds)
+    rows = [list(map(float, point)) + [float(results[kind][i]) for kind in args.kinds]
+            for i, point in enumerate(points)]
+    _write(rows, header, args.format, args.output)
+
+
+def run_path(args):
+    from draw_based_on_models import (HISTORY_KINDS, StopConditions, fracture_history, generate_path,
+                                      generate_points_adaptive)
+
+    stop = StopConditions(max_extension=args.max_extension, max_steps=args.max_steps)
+    if args.adaptive is not None:
+        points, report = generate_points_adaptive((0, 0), (args.precrack, 0), args.theta, args.width, args.length,
+                                                  args.increment, args.method, args.adaptive, backend=args.backend,
+                                                  stop=stop)
+        print(f'stopped: {report["reason"]} after {len(points) - 2} steps; model calls: {report["model_calls"]}, '
+              f'fixed increment {report["fixed_increment"]:.3g} would need about {report["fixed_increment_calls"]} '
+              f'(saved {report["calls_saved"]}); estimated error {report["error_estimate"]:.3g} mm', file=sys.stderr)
+    else:
+        points, reason = generate_path((0, 0), (args.precrack, 0), args.theta, args.width, args.length,
+                                       args.increment, args.method, args.backend, stop)
+        print(f'stopped: {reason} after {len(points) - 2} steps', file=sys.stderr)
+    header = ['x', 'y']
+    rows = [[float(x), float(y)] for x, y in points]
+    if args.history:
+        history = fracture_history(points, args.theta, args.width, args.length, args.method, backend=args.backend)
+        header += ['extension'] + list(HISTORY_KINDS)
+        for i, row in enumerate(rows):
+            row.extend(float(history[name][i]) for name in ['extension', *HISTORY_KINDS])
+    _write(rows, header, args.format, args.output)
+
+
+def run_fit(args):
+    from inverse_fit import fit_theta
+
+    result = fit_theta(_read_points(args.input, 2), args.width, args.length, args.precrack, args.increment,
+                       args.method, args.backend, args.fit_precrack, confidence=args.confidence)
+    print(f'model evaluations: {result["model_evaluations"]} in {result["paths_evaluated"]} paths', file=sys.stderr)
+    header = ['theta', 'theta_low', 'theta_high', 'precrack', 'precrack_low', 'precrack_high', 'rms_distance']
+    interval = result['confidence_interval']
+    precrack_interval = interval.get('precrack', (result['precrack'], result['precrack']))
+    _write([[result['theta'], *interval['theta'], result['precrack'], *precrack_interval, result['rms_distance']]],
+           header, args.format, args.output)
+
+
+def _distribution(values):
+    if len(values) == 1:
+        return float(values[0])
+    return (values[0], *map(float, values[1:]))
+
+
+def run_monte_carlo(args):
+    from monte_carlo import INPUTS, run_monte_carlo
+
+    distributions = {name: _distribution(getattr(args, name)) for name in INPUTS if getattr(args, name)}
+    result = run_monte_carlo(distributions, args.samples, args.seed, args.method, args.backend,
+                             workers=args.workers, percentiles=args.percentiles)
+    exit_position = result['exit']
+    print(f'{result["n_samples"]} paths, exit position y = {exit_position["mean"]:.3f} ± {exit_position["std"]:.3f} mm '
+          f'({exit_position["count"]} paths reached the ligament edge)', file=sys.stderr)
+    header = ['x', 'count', 'mean', 'std'] + [f'p{q:g}' for q in args.percentiles]
+    columns = [result['x'], result['count'], result['mean'], result['std'], *result['percentiles'].values()]
+    _write([[float(value) for value in row] for row in zip(*columns)], header, args.format, args.output)
+
+
+def run_field_map(args):
+    from field_map import compute_field_map, save_field_map
+
+    field = compute_field_map(args.beta, args.theta, args.width, args.length, args.shape, args.x_range, args.y_range,
+                              args.kinds, args.method, args.backend, args.chunk_size, args.workers)
+    for file_name in save_field_map(field, args.output_dir, not args.no_images):
+        print(file_name)
+
+
+def run_tabulate(args):
+    from surrogate_grid import SurrogateGrid, surrogate_path, validate
+
+    grid = SurrogateGrid.tabulate(args.kind, args.method, shape=args.shape, backend=args.backend)
+    path = args.output or surrogate_path(args.kind, args.method)
+    grid.save(path)
+    report = validate(grid, args.validation_points, backend=args.backend)
+    report['path'] = path
+    print(json.dumps(report, indent=2))
+
+
+def run_serve(args):
+    import asyncio
+
+    from prediction_server import serve
+
+    print(f'serving on {args.unix_socket or f"http://127.0.0.1:{args.port}"}', file=sys.stderr)
+    asyncio.run(serve(args.port, args.unix_socket, args.window_ms / 1000, args.max_batch, args.methods,
+                      args.backend))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cts', description='Crack path and fracture parameter predictions for '
+                                                             'CTS specimens.')
+    parser.add_argument('--timing', action='store_true', help='print start-up and total time to stderr')
+    parser.add_argument('--stats', action='store_true',
+                        help='print model loading, inference and step statistics to stderr')
+    parser.add_argument('--profile', metavar='PATH', help='write a Chrome trace of the run to PATH')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser):
+        subparser.add_argument('--method', choices=METHODS, default='DNN')
+        subparser.add_argument('--backend', choices=BACKENDS, default='keras',
+                               help='inference backend: numpy for the DNN models, surrogate for tabulated grids')
+        subparser.add_argument('--format', choices=('json', 'csv'), default='json')
+        subparser.add_argument('--output', help='output file (default: standard output)')
+        subparser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, metavar='PATH',
+                               help='cache predictions in a persistent database (default: %(const)s)')
+
+    predict = subparsers.add_parser('predict', help='predict fracture parameters at crack-tip positions')
+    predict.add_argument('--point', nargs=4, type=float, action='append', metavar=('BETA', 'THETA', 'X/W', 'Y/L'),
+                         help='crack-tip position; can be given several times')
+    predict.add_argument('--input', help='CSV file with beta, theta, x/W, y/L columns')
+    predict.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    add_common(predict)
+    predict.set_defaults(func=run_predict)
+
+    path = subparsers.add_parser('path', help='predict the crack path')
+    path.add_argument('--length', type=float, default=71.4, help='length of the specimen (L)')
+    path.add_argument('--width', type=float, default=42, help='width of the specimen (W)')
+    path.add_argument('--precrack', type=float, default=19, help='initial crack length (a)')
+    path.add_argument('--theta', type=float, default=45, help='loading direction angle')
+    path.add_argument('--increment', type=float, default=2, help='increment size (Δa)')
+    path.add_argument('--adaptive', type=float, metavar='TOLERANCE',
+                      help='adapt the increment to keep the deviation from the converged path below TOLERANCE [mm]; '
+                           '--increment is the initial increment')
+    path.add_argument('--max-extension', type=float, help='stop once the crack has grown by this length [mm]')
+    path.add_argument('--max-steps', type=int, help='stop after this number of increments')
+    path.add_argument('--history', action='store_true',
+                      help='add the crack extension and Y1, Y2, T and J at every crack-tip position')
+    add_common(path)
+    path.set_defaults(func=run_path)
+
+    fit = subparsers.add_parser('fit', help='fit the loading angle to a measured crack path')
+    fit.add_argument('input', help='CSV file with the x, y coordinates of the measured path (like the path output)')
+    fit.add_argument('--length', type=float, default=71.4, help='length of the specimen (L)')
+    fit.add_argument('--width', type=float, default=42, help='width of the specimen (W)')
+    fit.add_argument('--precrack', type=float, default=19, help='initial crack length (a), the start value if fitted')
+    fit.add_argument('--fit-precrack', action='store_true', help='fit the initial crack length as well')
+    fit.add_argument('--increment', type=float, default=1, help='increment size (Δa) of the simulated paths')
+    fit.add_argument('--confidence', type=float, default=0.95, help='level of the confidence interval')
+    add_common(fit)
+    fit.set_defaults(func=run_fit)
+
+    monte_carlo = subparsers.add_parser('monte-carlo', help='propagate input tolerances to the crack path')
+    for name, help_text in [('theta', 'loading direction angle'), ('precrack', 'initial crack length (a)'),
+                            ('width', 'width of the specimen (W)'), ('length', 'length of the specimen (L)'),
+                            ('increment', 'increment size (Δa)')]:
+        monte_carlo.add_argument(f'--{name}', nargs='+', metavar='VALUE',
+                                 help=f'{help_text}: a fixed value, "normal MEAN STD", "uniform LOW HIGH" or '
+                                      f'"triangular LOW MODE HIGH"')
+    monte_carlo.add_argument('--samples', type=int, default=10000, help='number of sampled specimens')
+    monte_carlo.add_argument('--seed', type=int, default=0)
+    monte_carlo.add_argument('--workers', type=int, help='worker processes (default: all cores, 0: none)')
+    monte_carlo.add_argument('--percentiles', nargs='+', type=float, default=[5, 50, 95])
+    add_common(monte_carlo)
+    monte_carlo.set_defaults(func=run_monte_carlo)
+
+    field_map = subparsers.add_parser('field-map', help='evaluate fracture parameters on a grid of crack-tip positions')
+    field_map.add_argument('--beta', type=float, default=1, help='crack angle beta')
+    field_map.add_argument('--theta', type=float, default=45, help='loading direction angle')
+    field_map.add_argument('--length', type=float, default=71.4, help='length of the specimen (L)')
+    field_map.add_argument('--width', type=float, default=42, help='width of the specimen (W)')
+    field_map.add_argument('--shape', nargs=2, type=int, default=[200, 200], metavar=('NX', 'NY'),
+                           help='number of grid positions along x and y')
+    field_map.add_argument('--x-range', nargs=2, type=float, metavar=('MIN', 'MAX'),
+                           help='crack-tip x range in mm (default: range of the training data)')
+    field_map.add_argument('--y-range', nargs=2, type=float, metavar=('MIN', 'MAX'),
+                           help='crack-tip y range in mm (default: range of the training data)')
+    field_map.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    field_map.add_argument('--method', choices=METHODS, default='DNN')
+    field_map.add_argument('--backend', choices=BACKENDS, default='keras',
+                           help='model backend (numpy: DNN without Keras, surrogate: tabulated grid)')
+    field_map.add_argument('--chunk-size', type=int, default=65536, help='grid positions per model call')
+    field_map.add_argument('--workers', type=int, default=0, help='worker processes (default: 0, compute in this process)')
+    field_map.add_argument('--no-images', action='store_true', help='only write the arrays')
+    field_map.add_argument('--output-dir', default='field_maps', help='directory for field_map.npz and the images')
+    field_map.set_defaults(func=run_field_map)
+
+    tabulate = subparsers.add_parser('tabulate', help='tabulate a model on a grid for the surrogate backend')
+    tabulate.add_argument('kind', choices=KINDS)
+    tabulate.add_argument('--method', choices=METHODS, default='DNN')
+    tabulate.add_argument('--backend', choices=('keras', 'numpy'), default='keras',
+                          help='backend used to evaluate the grid nodes')
+    tabulate.add_argument('--shape', nargs=4, type=int, default=[73, 19, 35, 49],
+                          metavar=('BETA', 'THETA', 'X/W', 'Y/L'), help='number of grid nodes along every input')
+    tabulate.add_argument('--validation-points', type=int, default=10000,
+                          help='number of held-out points for the error report')
+    tabulate.add_argument('--output', help='grid file (default: next to the model in MODELS/)')
+    tabulate.set_defaults(func=run_tabulate)
+
+    serve = subparsers.add_parser('serve', help='run a local prediction service')
+    serve.add_argument('--port', type=int, default=8765, help='port on 127.0.0.1')
+    serve.add_argument('--unix-socket', help='listen on this Unix socket instead of a port')
+    serve.add_argument('--window-ms', type=float, default=2, help='time window for coalescing requests')
+    serve.add_argument('--max-batch', type=int, default=4096, help='largest number of rows in one model call')
+    serve.add_argument('--methods', nargs='+', choices=METHODS, default=['DNN'], help='models to load at start-up')
+    serve.add_argument('--backend', choices=('keras', 'numpy'), default='keras',
+                       help='backend whose models are loaded at start-up and used by requests that name none')
+    serve.set_defaults(func=run_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        stats = stack.enter_context(instrumentation.collect()) if args.stats or args.profile else None
+        if getattr(args, 'cache', None):
+            from predictions_based_on_models import disable_cache, enable_cache
+
+            cache = enable_cache(args.cache)
+            # Closing the cache writes the access times of its hits
+            stack.callback(disable_cache)
+            args.func(args)
+            print(f'cache: {json.dumps(cache.stats())}', file=sys.stderr)
+        else:
+            args.func(args)
+    if args.stats:
+        print(json.dumps(stats.summary(), indent=2), file=sys.stderr)
+    if args.profile:
+        stats.save_trace(args.profile)
+    if args.timing:
+        print(f'start-up: {started - _START:.3f} s, total: {time.perf_counter() - _START:.3f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 import math
 
-import joblib
 import numpy as np
-from matplotlib import pyplot as plt, patches
 
-# Load the scaler from the file
-loaded_scaler = joblib.load(f'MODELS/scaler_angle_nn_optuna_ver5.pkl')
+import instrumentation
+from predictions_based_on_models import predict_batch, predict_rows
 
-def return_next_point(p1, p2, theta, width, length, d, method, loaded_model):
+HISTORY_KINDS = ('Y1', 'Y2', 'T', 'J')
+# Path points with a larger x are not drawn
+PLOT_LIMIT = 40
+
+
+def return_next_point(p1, p2, theta, width, length, d, method, backend='keras'):
     x_prev, y_prev = p2
     x_before_prev, y_before_prev = p1
     pre_x = x_prev / width
@@ -15,12 +18,7 @@ def return_next_point(p1, p2, theta, width, length, d, method, loaded_model):
     angle_of_last_part = math.atan2(y_prev - y_before_prev, x_prev - x_before_prev)
     data_point = [90 - abs(math.degrees(angle_of_last_part)), theta, pre_x, pre_y]
     data_array = np.array(data_point, dtype=np.float32).reshape(1, -1)
-    if method == 'DNN':
-        new_angle = loaded_model.predict(loaded_scaler.transform(data_array))[0][0]
-    elif method == 'XGBoost':
-        new_angle = loaded_model.predict(data_array)[0]
-    else:  # tabnet
-        new_angle = loaded_model.predict(data_array)[0][0]
+    new_angle = predict_rows('angle', method, data_array, backend=backend)[0]
     # Calculate the new point coordinates
     total_angle = -1 * math.radians(new_angle) + (math.pi / 2 - abs(angle_of_last_part))
     x_new = x_prev + d * math.sin(abs(total_angle))
@@ -29,35 +27,325 @@ def return_next_point(p1, p2, theta, width, length, d, method, loaded_model):
     return (x_new, y_new), total_angle
 
 
-def generate_points(p1, p2, theta, width, length, d, method):
-    points = [p1, p2]
-    # Load the model from the file
-    if method == "DNN":
-        version = 5
-        loaded_model = joblib.load(f'MODELS/model_angle_nn_optuna_ver{version}.pkl')
-    elif method == "XGBoost":
-        version = 8
-        loaded_model = joblib.load(f'MODELS/model_angle_XGBoost_ver{version}.pkl')
-    else:
-        version = 6
-        loaded_model = joblib.load(f'MODELS/model_angle_tabnet_ver{version}.pkl')
-    while points[-1][0] < width:
-        new_point = return_next_point(points[-2], points[-1], theta, width, length, d, method, loaded_model)
-        points.append(new_point[0])
+class StopConditions:
+    """When the growth of a crack path ends.
 
-    return points
+    A path always stops once it leaves the specimen (``'ligament_exit'``).
+    With the pin geometry it also stops when its last segment reaches a hole
+    (``'hole'``); ``x_limit`` stops it at the first point beyond the plotting
+    window (``'plot_window'``), ``max_extension`` [mm] and ``max_steps``
+    bound its growth (``'max_extension'``, ``'max_steps'``). All conditions
+    are checked on arrays of paths at once.
+    """
 
+    def __init__(self, vertical_distance=None, horizontal_distance=None, diameter=None, max_extension=None,
+                 max_steps=None, x_limit=None):
+        self.vertical_distance = vertical_distance
+        self.horizontal_distance = horizontal_distance
+        self.diameter = diameter
+        self.max_extension = max_extension
+        self.max_steps = max_steps
+        self.x_limit = x_limit
+
+    def check(self, previous, last, width, length, extension, steps):
+        """Reason to stop each of the paths whose last segment runs from ``previous`` to ``last``, '' to go on.
+
+        ``previous`` and ``last`` are (M, 2) arrays, ``width``, ``length`` and
+        ``extension`` (the crack growth so far) scalars or (M,) arrays and
+        ``steps`` the number of increments grown.
+        """
+        reasons = np.full(len(last), '', dtype=object)
+
+        def mark(stopped, reason):
+            reasons[(reasons == '') & stopped] = reason
+
+        if self.diameter is not None:
+            segment = last - previous
+            squared_length = np.maximum(np.sum(segment ** 2, axis=1), 1e-12)
+            for x_hole, y_hole in hole_positions(length, width, self.vertical_distance, self.horizontal_distance):
+                # Hole centre in path coordinates
+                centre = np.column_stack(np.broadcast_arrays(width - x_hole, y_hole - length / 2))
+                t = np.clip(np.sum((centre - previous) * segment, axis=1) / squared_length, 0, 1)
+                closest = previous + t[:, None] * segment
+                mark(np.hypot(*(centre - closest).T) <= self.diameter / 2, 'hole')
+        mark((last[:, 0] >= width) | (np.abs(last[:, 1]) >= np.divide(length, 2)), 'ligament_exit')
+        if self.x_limit is not None:
+            mark(last[:, 0] > self.x_limit, 'plot_window')
+        if self.max_extension is not None:
+            mark(np.asarray(extension) >= self.max_extension, 'max_extension')
+        if self.max_steps is not None:
+            mark(np.broadcast_to(steps >= self.max_steps, reasons.shape), 'max_steps')
+        return reasons
+
+
+def iter_points(p1, p2, theta, width, length, d, method, backend='keras', cancel=None, stop=None):
+    """Yield the points of a crack path one increment at a time.
+
+    ``cancel`` is an optional ``threading.Event``; once it is set the
+    iteration stops before the next model call. ``stop`` are the
+    StopConditions (by default the path ends when it leaves the specimen).
+    The reason why the path ended is the return value of the generator.
+    """
+    stop = StopConditions() if stop is None else stop
+    yield p1
+    yield p2
+    previous, last = p1, p2
+    extension = 0.0
+    steps = 0
+    reason = 'ligament_exit' if last[0] >= width else ''
+    while not reason:
+        if cancel is not None and cancel.is_set():
+            return 'cancelled'
+        with instrumentation.span('step', 'geometry'):
+            new_point = return_next_point(previous, last, theta, width, length, d, method, backend)
+            previous, last = last, new_point[0]
+            extension += math.dist(previous, last)
+            steps += 1
+            reason = stop.check(np.array([previous]), np.array([last]), width, length, extension, steps)[0]
+        yield last
+    return reason
+
+
+def generate_path(p1, p2, theta, width, length, d, method, backend='keras', stop=None):
+    """The points of a crack path and the reason why it ended, see iter_points."""
+    path = iter_points(p1, p2, theta, width, length, d, method, backend, stop=stop)
+    points = []
+    while True:
+        try:
+            points.append(next(path))
+        except StopIteration as end:
+            return points, end.value
+
+
+def generate_points(p1, p2, theta, width, length, d, method, backend='keras', stop=None):
+    return generate_path(p1, p2, theta, width, length, d, method, backend, stop)[0]
+
+
+def fracture_history(points, theta, width, length, method, kinds=HISTORY_KINDS, backend='keras'):
+    """Fracture parameters at every crack-tip position of a path.
+
+    The tip at ``points[i]`` sees a crack whose last segment starts at
+    ``points[i - 1]``, so beta is taken from that segment like in
+    return_next_point. Every kind is predicted with one batched model call.
+    Returns a dict of arrays aligned with ``points``: the crack extension
+    from the initial crack tip and one array per kind, NaN at ``points[0]``.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    data_array, _ = next_point_inputs(points[:-1], points[1:], theta, width, length)
+    with instrumentation.span('fracture history', 'geometry', rows=len(data_array)):
+        results = predict_batch(data_array, kinds, method, backend=backend)
+    segments = np.hypot(*np.diff(points[1:], axis=0).T)
+    history = {'extension': np.concatenate([[np.nan, 0], np.cumsum(segments)])}
+    for kind, values in results.items():
+        history[kind] = np.concatenate([[np.nan], values])
+    return history
+
+
+def fracture_history_batch(points, lengths, theta, width, length, method, kinds=HISTORY_KINDS, backend='keras'):
+    """fracture_history of many paths at once, with one batched model call per kind.
+
+    ``points`` and ``lengths`` are as returned by generate_points_batch and
+    ``theta``, ``width`` and ``length`` scalars or (M,) arrays. Returns a
+    dict of (M, S) arrays, NaN at ``points[:, 0]`` and after the end of
+    every path.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n_paths, n_points = points.shape[:2]
+    # The segment ending at points[:, i] gives the inputs for the tip at i
+    valid = np.arange(1, n_points) < np.asarray(lengths)[:, None]
+    rows, columns = np.nonzero(valid)
+    theta, width, length = (np.broadcast_to(values, (n_paths,))[rows] for values in (theta, width, length))
+    data_array, _ = next_point_inputs(points[rows, columns], points[rows, columns + 1], theta, width, length)
+    with instrumentation.span('fracture history', 'geometry', rows=len(data_array)):
+        results = predict_batch(data_array, kinds, method, backend=backend)
+    segments = np.hypot(*np.diff(points[:, 1:], axis=1).transpose(2, 0, 1))
+    history = {'extension': np.full((n_paths, n_points), np.nan)}
+    history['extension'][:, 1] = 0
+    history['extension'][:, 2:] = np.cumsum(segments, axis=1)
+    history['extension'][:, 1:][~valid] = np.nan
+    for kind, values in results.items():
+        history[kind] = np.full((n_paths, n_points), np.nan)
+        history[kind][rows, columns + 1] = values
+    return history
+
+
+def next_point_inputs(p1, p2, theta, width, length):
+    """Angle-model inputs for (M, 2) arrays of the last two points of M paths."""
+    angle_of_last_part = np.arctan2(p2[:, 1] - p1[:, 1], p2[:, 0] - p1[:, 0])
+    data_array = np.column_stack([90 - np.abs(np.degrees(angle_of_last_part)),
+                                  np.broadcast_to(theta, angle_of_last_part.shape),
+                                  p2[:, 0] / width, p2[:, 1] / length])
+    return data_array, angle_of_last_part
+
+
+def advance_points(p2, angle_of_last_part, new_angle, d):
+    # Calculate the new point coordinates
+    total_angle = -1 * np.radians(new_angle) + (np.pi / 2 - np.abs(angle_of_last_part))
+    x_new = p2[:, 0] + d * np.sin(np.abs(total_angle))
+    y_new = p2[:, 1] - d * np.cos(np.abs(total_angle))
+
+    return np.column_stack([x_new, y_new]), total_angle
+
+
+def return_next_points(p1, p2, theta, width, length, d, method, backend='keras'):
+    """Vectorized return_next_point for (M, 2) arrays of the last two points of M paths."""
+    data_array, angle_of_last_part = next_point_inputs(p1, p2, theta, width, length)
+    new_angle = predict_rows('angle', method, data_array, backend=backend)
+    return advance_points(p2, angle_of_last_part, new_angle, d)
+
+
+def generate_points_batch(p1, p2, theta, width, length, d, method, backend='keras', max_steps=None, stop=None):
+    """Grow many crack paths in lockstep with one model call per step.
+
+    ``p1`` and ``p2`` are (2,) or (M, 2) arrays of starting points; ``theta``,
+    ``width``, ``length`` and ``d`` are scalars or (M,) arrays. Paths that have
+    stopped (by default when they leave the specimen) are masked out of the
+    following model calls. Returns an (M, S, 2) array of points padded with
+    NaN, the number of points of every path and an (M,) array of the reasons
+    why the paths ended.
+    """
+    stop = StopConditions() if stop is None else stop
+    p1 = np.atleast_2d(np.asarray(p1, dtype=np.float64))
+    p2 = np.atleast_2d(np.asarray(p2, dtype=np.float64))
+    p1_x, p1_y, p2_x, p2_y, theta, width, length, d = (
+        np.array(values, dtype=np.float64) for values in np.broadcast_arrays(
+            p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1], theta, width, length, d))
+    previous = np.column_stack([p1_x, p1_y])
+    last = np.column_stack([p2_x, p2_y])
+    steps = [previous.copy(), last.copy()]
+    lengths = np.full(len(last), 2)
+    extension = np.zeros(len(last))
+    reasons = np.where(last[:, 0] < width, '', 'ligament_exit').astype(object)
+    active = reasons == ''
+    while active.any():
+        if max_steps is not None and len(steps) - 2 >= max_steps:
+            reasons[active] = 'max_steps'
+            break
+        with instrumentation.span('step', 'geometry', paths=int(active.sum())):
+            idx = np.flatnonzero(active)
+            new_points, _ = return_next_points(previous[idx], last[idx], theta[idx], width[idx], length[idx], d[idx],
+                                               method, backend)
+            step = np.full_like(last, np.nan)
+            step[idx] = new_points
+            steps.append(step)
+            extension[idx] += np.hypot(*(new_points - last[idx]).T)
+            previous[idx] = last[idx]
+            last[idx] = new_points
+            lengths[idx] += 1
+            reasons[idx] = stop.check(previous[idx], new_points, width[idx], length[idx], extension[idx],
+                                      len(steps) - 2)
+            active[idx] = reasons[idx] == ''
+
+    return np.stack(steps, axis=1), lengths, reasons
+
+
+def generate_points_adaptive(p1, p2, theta, width, length, d, method, tolerance=0.05, d_min=None, d_max=None,
+                             backend='keras', stop=None):
+    """Grow a crack path with step-size control instead of a fixed increment.
+
+    Every step advances the path by four increments of size h and compares
+    their end point with two increments of size 2h grown from the same tip;
+    the distance estimates the error of the four increments. It is kept
+    below ``tolerance`` [mm] per 1.25 (W - a) of crack growth, so the
+    deviation from the converged path (d -> 0) stays within ``tolerance``
+    [mm] for paths up to 1.25 times the ligament. Steps with a larger error
+    are repeated with a smaller h, and h grows again (up to ``d_max``, by
+    default 2 * d) where the kink angle changes slowly. ``d_min`` (by default
+    d / 128) is accepted regardless of the error; a summed error estimate
+    above ``tolerance`` in the report shows that this happened. Comparing
+    two increments with four, not one with two, averages out the alternating
+    kink angles the models predict right after the initial crack.
+
+    ``stop`` are the StopConditions like for generate_points. Returns the
+    points and a report with the model calls used, about the number a path
+    with the fixed increment ``d`` would need, the summed error estimate and
+    the reason why the path ended.
+    """
+    stop = StopConditions() if stop is None else stop
+    d_min = d / 128 if d_min is None else d_min
+    d_max = 2 * d if d_max is None else d_max
+    # Error allowed per mm of crack growth
+    error_rate = tolerance / (1.25 * (width - p2[0]))
+    points = [tuple(p1), tuple(p2)]
+    step = d
+    model_calls = 0
+    model_evaluations = 0
+    error_estimate = 0.0
+    extension = 0.0
+    increments = []
+    reason = 'ligament_exit' if p2[0] >= width else ''
+    while not reason:
+        previous = np.array([points[-2], points[-2]], dtype=np.float64)
+        last = np.array([points[-1], points[-1]], dtype=np.float64)
+        sizes = np.array([2 * step, step])
+        # The coarse and the fine path take their first two increments in the same model calls
+        first, _ = return_next_points(previous, last, theta, width, length, sizes, method, backend)
+        second, _ = return_next_points(last, first, theta, width, length, sizes, method, backend)
+        third, _ = return_next_points(first[1:], second[1:], theta, width, length, step, method, backend)
+        fourth, _ = return_next_points(second[1:], third, theta, width, length, step, method, backend)
+        model_calls += 4
+        model_evaluations += 6
+        error = math.dist(second[0], fourth[0])
+        allowed = error_rate * 4 * step
+        if error > allowed and step > d_min:
+            step = max(d_min, step * max(0.25, 0.9 * allowed / error))
+            continue
+        error_estimate += error
+        for point in (first[1], second[1], third[0], fourth[0]):
+            previous_point = points[-1]
+            points.append(tuple(point))
+            increments.append(step)
+            extension += math.dist(previous_point, points[-1])
+            reason = stop.check(np.array([previous_point]), np.array([points[-1]]), width, length, extension,
+                                len(increments))[0]
+            if reason:
+                break
+        # The error of a step grows with the square of h, its error per mm linearly
+        growth = 2 if error == 0 else min(2, 0.9 * allowed / error)
+        step = min(d_max, max(d_min, step * growth))
+
+    fixed_calls = math.ceil(extension / d)
+    report = {
+        'model_calls': model_calls,
+        'model_evaluations': model_evaluations,
+        'fixed_increment': d,
+        'fixed_increment_calls': fixed_calls,
+        'calls_saved': fixed_calls - model_calls,
+        'error_estimate': error_estimate,
+        'smallest_increment': min(increments, default=d),
+        'largest_increment': max(increments, default=d),
+        'reason': reason,
+    }
+    return points, report
+
+
+def hole_positions(length, width, vertical_distance, horizontal_distance):
+    x_hole1 = (width - horizontal_distance) / 2
+    positions = []
+    for offset in [-1, 1]:  # -1 for lower holes, 1 for upper holes
+        y = length / 2 + offset * vertical_distance / 2
+        for i in range(3):  # Three horizontal positions
+            x = x_hole1 + i * horizontal_distance / 2
+            positions.append((x, y))
+    return positions
+
+
+def draw_specimen(length, width, vertical_distance, horizontal_distance, diameter, precrack, method, ax=None):
+    """Create the figure with the specimen, its holes and the grid, without a crack path.
+
+    The specimen is drawn into ``ax`` if given, otherwise into a new figure.
+    """
+    from matplotlib import pyplot as plt, patches
 
-def draw_crack_path(length, width, vertical_distance, horizontal_distance, diameter, precrack, theta, increment, method,
-                    fig_needed):
     total_width = width
     total_height = length
-    x_hole1 = (width - horizontal_distance) / 2
-    y_hole1 = (length - vertical_distance) / 2
     radius = diameter / 2
 
     # Chart settings
-    fig, ax = plt.subplots(dpi=120)
+    if ax is None:
+        fig, ax = plt.subplots(dpi=120)
+    else:
+        fig = ax.figure
     ax.set_aspect('equal')
     ax.set_xlim(-5, total_width + 5)
     ax.set_ylim(-5, total_height + 5)
@@ -66,41 +354,9 @@ def draw_crack_path(length, width, vertical_distance, horizontal_distance, diame
     ax.add_patch(patches.Rectangle((0, 0), total_width, total_height, edgecolor='black', facecolor='lightgrey', lw=2))
 
     # Add holes
-    hole_positions = []
-
-    for offset in [-1, 1]:  # -1 for lower holes, 1 for upper holes
-        y = total_height / 2 + offset * vertical_distance / 2
-        for i in range(3):  # Three horizontal positions
-            x = x_hole1 + i * horizontal_distance / 2
-            hole_positions.append((x, y))
-
-    for x, y in hole_positions:
+    for x, y in hole_positions(length, width, vertical_distance, horizontal_distance):
         ax.add_patch(patches.Circle((x, y), radius, edgecolor='blue', facecolor='white', lw=2))
 
-    kolejne_punkty = generate_points((0, 0), (precrack, 0), theta, total_width, total_height, increment, method)
-
-    ax.plot([total_width - kolejne_punkty[0][0], total_width - kolejne_punkty[1][0]],
-            [total_height / 2 + kolejne_punkty[0][1], total_height / 2 + kolejne_punkty[1][1]],
-            lw=2, c='k', solid_capstyle='round')
-
-    x_coords = []
-    y_coords = []
-    for i in range(1, len(kolejne_punkty) - 1):
-        if kolejne_punkty[i][0] > 40:
-            break
-        # Collect the coordinates
-        x_coords.extend([
-            total_width - kolejne_punkty[i][0],
-            total_width - kolejne_punkty[i + 1][0]
-        ])
-        y_coords.extend([
-            total_height / 2 + kolejne_punkty[i][1],
-            total_height / 2 + kolejne_punkty[i + 1][1]
-        ])
-
-    # Plot all lines as a single plot
-    ax.plot(x_coords, y_coords, lw=1, c='g', label='θ = 45°', marker='o', ms=0.5)
-
     # Add axis and captions
     ax.set_xlabel('X [mm]')
     ax.set_ylabel('Y [mm]')
@@ -127,11 +383,91 @@ def draw_crack_path(length, width, vertical_distance, horizontal_distance, diame
               colors='black', linestyles=':', linewidth=0.8, label='_nolegend_')  # Major grid
     ax.vlines(minor_grid_lines, ymin=20, ymax=length / 2,
               colors='gray', linestyles=':', linewidth=0.4, label='_nolegend_')  # Minor grid
+    return fig, ax
+
+
+def path_coordinates(points, width, length):
+    """Specimen coordinates of the crack path after the initial crack, up to the plotting limit."""
+    x_coords = []
+    y_coords = []
+    for i in range(1, len(points) - 1):
+        if points[i][0] > PLOT_LIMIT:
+            break
+        # Collect the coordinates
+        x_coords.extend([
+            width - points[i][0],
+            width - points[i + 1][0]
+        ])
+        y_coords.extend([
+            length / 2 + points[i][1],
+            length / 2 + points[i + 1][1]
+        ])
+    return x_coords, y_coords
+
+
+def plot_path(ax, points, width, length):
+    total_width = width
+    total_height = length
+    ax.plot([total_width - points[0][0], total_width - points[1][0]],
+            [total_height / 2 + points[0][1], total_height / 2 + points[1][1]],
+            lw=2, c='k', solid_capstyle='round')
+
+    x_coords, y_coords = path_coordinates(points, width, length)
+
+    # Plot all lines as a single plot
+    return ax.plot(x_coords, y_coords, lw=1, c='g', label='θ = 45°', marker='o', ms=0.5)[0]
+
+
+def plot_history(ax, history):
+    """Plot the fracture parameters of fracture_history against the crack extension."""
+    for kind in HISTORY_KINDS:
+        if kind in history:
+            ax.plot(history['extension'], history[kind], lw=1, marker='o', ms=1.5, label=kind)
+    ax.set_xlabel('Crack extension [mm]')
+    ax.set_ylabel('Fracture parameter')
+    # T and J grow by orders of magnitude more than Y1 and Y2 near the edge
+    ax.set_yscale('symlog')
+    ax.set_title('Fracture parameters along the crack path')
+    ax.grid(True, linestyle=':', linewidth=0.5)
+    ax.legend()
+
+
+def draw_crack_path(length, width, vertical_distance, horizontal_distance, diameter, precrack, theta, increment, method,
+                    fig_needed, backend='keras', with_history=False):
+    """Draw the specimen and the crack path; returns the figure if ``fig_needed``, otherwise shows it.
+
+    With ``with_history`` the fracture parameters along the path are plotted
+    next to the specimen, and ``(fig, points, history)`` is returned in both
+    cases: the path points and the fracture_history arrays aligned with them.
+    """
+    # matplotlib is only needed for drawing, so headless callers never import it
+    from matplotlib import pyplot as plt
+
+    with instrumentation.span('draw specimen', 'plotting'):
+        ax = None
+        if with_history:
+            _, (ax, history_ax) = plt.subplots(1, 2, dpi=120, figsize=(12, 5.5))
+        fig, ax = draw_specimen(length, width, vertical_distance, horizontal_distance, diameter, precrack, method, ax)
+
+    with instrumentation.span('generate path', 'geometry'):
+        # Points beyond the plotting window or inside a pin hole would not be drawn
+        stop = StopConditions(vertical_distance, horizontal_distance, diameter, x_limit=PLOT_LIMIT)
+        kolejne_punkty = generate_points((0, 0), (precrack, 0), theta, width, length, increment, method, backend,
+                                         stop)
+        if with_history:
+            history = fracture_history(kolejne_punkty, theta, width, length, method, backend=backend)
+
+    with instrumentation.span('draw path', 'plotting'):
+        plot_path(ax, kolejne_punkty, width, length)
+        if with_history:
+            plot_history(history_ax, history)
+            fig.tight_layout()
 
     # Display chart
     # plt.savefig('CTS_1', dpi=300)
+    if not fig_needed:
+        plt.show()
+    if with_history:
+        return fig, kolejne_punkty, history
     if fig_needed:
         return fig
-    else:
-        plt.show()
-
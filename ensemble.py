@@ -0,0 +1,149 @@
+"""Ensemble of every trained method whose model files are present.
+
+The methods are evaluated concurrently in a thread pool (Keras, XGBoost and
+TabNet release the GIL while they compute), so an ensemble prediction takes
+about as long as the slowest method instead of the sum of all of them. The
+spread between the methods serves as an estimate of the model uncertainty.
+"""
+import contextvars
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from draw_based_on_models import PLOT_LIMIT
+from model_registry import KINDS, METHODS, model_path, preload, scaler_path
+from numpy_inference import has_network
+from surrogate_grid import surrogate_path
+
+ENSEMBLE = 'Ensemble'
+
+
+def _has_artifacts(method, kinds, backend):
+    if backend == 'surrogate':
+        return all(os.path.exists(surrogate_path(kind, method)) for kind in kinds)
+    if backend == 'numpy' and method == 'DNN':
+        return all(has_network(kind) for kind in kinds)
+    paths = [model_path(kind, method) for kind in kinds]
+    if scaler_path(method) is not None:
+        paths.append(scaler_path(method))
+    return all(os.path.exists(path) for path in paths)
+
+
+def available_methods(kinds=KINDS, backend='keras'):
+    """Methods whose model files for all ``kinds`` are in MODELS/."""
+    return [method for method in METHODS if _has_artifacts(method, kinds, backend)]
+
+
+def warm_up(kinds=KINDS, methods=None, backend='keras'):
+    """Load the models of every available method concurrently and return the methods that loaded.
+
+    Methods whose models cannot be loaded (for example because xgboost or
+    pytorch-tabnet is not installed) are skipped with a warning.
+    """
+    if methods is None:
+        methods = available_methods(kinds, backend)
+    missing = [method for method in methods if not _has_artifacts(method, kinds, backend)]
+    if missing:
+        warnings.warn(f'{", ".join(missing)} models are skipped in the ensemble: model files missing')
+    methods = [method for method in methods if method not in missing]
+
+    def load(method):
+        preload(kinds, method, backend)
+
+    loaded = []
+    for method, error in zip(methods, _map(load, methods, return_errors=True)):
+        if error is None:
+            loaded.append(method)
+        else:
+            warnings.warn(f'{method} models are skipped in the ensemble: {error}')
+    return loaded
+
+
+def _map(function, methods, return_errors=False):
+    def call(method):
+        try:
+            result = function(method)
+        except Exception as error:
+            if not return_errors:
+                raise
+            return error
+        return None if return_errors else result
+
+    # Every call runs in its own copy of the caller's context, so the active instrumentation records it
+    contexts = [contextvars.copy_context() for _ in methods]
+    with ThreadPoolExecutor(max(1, len(methods)), thread_name_prefix='ensemble') as executor:
+        return list(executor.map(lambda context, method: context.run(call, method), contexts, methods))
+
+
+def _statistics(members):
+    values = np.stack(list(members.values()))
+    return {
+        'mean': values.mean(axis=0),
+        'std': values.std(axis=0),
+        'min': values.min(axis=0),
+        'max': values.max(axis=0),
+        'members': members,
+    }
+
+
+def predict_ensemble(points, kinds=KINDS, methods=None, backend='keras'):
+    """Predict fracture parameters with every available method at once.
+
+    ``points`` is an (N, 4) array of (beta, theta, x/W, y/L) rows. Returns a
+    dict mapping every kind to the ``mean``, ``std``, ``min`` and ``max`` over
+    the methods and the predictions of every method in ``members``.
+    """
+    from predictions_based_on_models import predict_batch
+
+    methods = warm_up(kinds, methods, backend)
+    if not methods:
+        raise FileNotFoundError('No method has all models needed for the ensemble in MODELS/')
+    predictions = _map(lambda method: predict_batch(points, kinds, method, backend=backend), methods)
+    return {kind: _statistics({method: result[kind] for method, result in zip(methods, predictions)})
+            for kind in kinds}
+
+
+def predict_ensemble_general(width, length, x_prev, y_prev, beta, theta, kinds=KINDS, backend='keras'):
+    """predict_general for the ensemble: the statistics of every kind at one crack-tip position."""
+    data_array = np.array([beta, theta, x_prev / width, y_prev / length], dtype=np.float32).reshape(1, -1)
+    return {kind: {name: value if name == 'members' else float(value[0]) for name, value in stats.items()}
+            for kind, stats in predict_ensemble(data_array, kinds, backend=backend).items()}
+
+
+def path_envelope(paths, n_points=200):
+    """Mean and range of several crack paths on a common grid of x positions.
+
+    The grid runs from the initial crack tip to the end of the shortest path,
+    so every path contributes to every grid point.
+    """
+    paths = [np.asarray(points, dtype=np.float64)[1:] for points in paths]
+    x = np.linspace(max(points[0, 0] for points in paths), min(points[:, 0].max() for points in paths), n_points)
+    y = np.stack([np.interp(x, *points[np.argsort(points[:, 0])].T) for points in paths])
+    return {'x': x, 'mean': y.mean(axis=0), 'lower': y.min(axis=0), 'upper': y.max(axis=0)}
+
+
+def ensemble_paths(p1, p2, theta, width, length, d, methods=None, backend='keras', cancel=None):
+    """Crack paths of every available method, computed concurrently, and their envelope."""
+    from draw_based_on_models import iter_points
+
+    methods = warm_up(('angle',), methods, backend)
+    if not methods:
+        raise FileNotFoundError('No method has an angle model for the ensemble in MODELS/')
+    paths = _map(lambda method: list(iter_points(p1, p2, theta, width, length, d, method, backend, cancel)), methods)
+    return {'methods': methods, 'paths': dict(zip(methods, paths)), 'envelope': path_envelope(paths)}
+
+
+def plot_envelope(ax, result, width, length, x_limit=PLOT_LIMIT):
+    """Draw the paths of ensemble_paths and their envelope in specimen coordinates."""
+    for method, points in result['paths'].items():
+        points = np.asarray(points)
+        points = points[1:][points[1:, 0] <= x_limit]
+        ax.plot(width - points[:, 0], length / 2 + points[:, 1], lw=0.8, label=method)
+    envelope = result['envelope']
+    shown = envelope['x'] <= x_limit
+    ax.fill_between(width - envelope['x'][shown], length / 2 + envelope['lower'][shown],
+                    length / 2 + envelope['upper'][shown], color='g', alpha=0.3, lw=0, label='Ensemble range')
+    ax.plot(width - envelope['x'][shown], length / 2 + envelope['mean'][shown], lw=1.5, c='g', label='Ensemble mean')
+    ax.legend(loc='lower left', fontsize='small')
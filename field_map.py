@@ -0,0 +1,93 @@
+"""Fracture parameters over a dense grid of crack-tip positions.
+
+For a fixed beta and theta every model is evaluated at all (x, y) positions
+of a regular grid, in chunks of ``chunk_size`` positions so the model inputs
+and activations stay small however fine the grid is::
+
+    field = compute_field_map(beta=1, theta=45, shape=(500, 500))
+    save_field_map(field, 'field_maps')
+
+Positions are in the coordinates of ``generate_points`` (mm). By default the
+grid covers the range of x/W and y/L of the training data.
+"""
+import os
+
+import numpy as np
+
+from model_registry import KINDS, preload
+from predictions_based_on_models import predict_batch
+from surrogate_grid import training_bounds
+from worker_pool import map_bounded
+
+DEFAULT_CHUNK_SIZE = 65536
+LABELS = {'Y1': 'Y$_I$', 'Y2': 'Y$_{II}$', 'angle': 'Kink angle [°]', 'T': 'T-stress', 'J': 'J-integral'}
+
+
+def _run_chunk(start, data_array, kinds, method, backend):
+    return start, predict_batch(data_array, kinds, method, backend=backend)
+
+
+def compute_field_map(beta, theta, width=42, length=71.4, shape=(200, 200), x_range=None, y_range=None,
+                      kinds=KINDS, method='DNN', backend='keras', chunk_size=DEFAULT_CHUNK_SIZE, workers=0):
+    """Evaluate ``kinds`` at every position of an ``shape`` = (nx, ny) grid.
+
+    ``x_range`` and ``y_range`` are in mm. Returns a dict with the grid axes
+    ``x`` and ``y`` and one (ny, nx) float32 array per kind. ``workers`` > 0
+    (or None for all cores) spreads the chunks over worker processes.
+    """
+    if x_range is None or y_range is None:
+        bounds = training_bounds()
+        x_range = bounds[2] * width if x_range is None else x_range
+        y_range = bounds[3] * length if y_range is None else y_range
+    x = np.linspace(*x_range, shape[0])
+    y = np.linspace(*y_range, shape[1])
+    n_rows = len(x) * len(y)
+    field = {'x': x, 'y': y, 'beta': beta, 'theta': theta, 'width': width, 'length': length, 'method': method}
+    for kind in kinds:
+        field[kind] = np.empty((len(y), len(x)), dtype=np.float32)
+
+    def chunks():
+        # Rows are generated per chunk, so the full input table is never built
+        for start in range(0, n_rows, chunk_size):
+            index = np.arange(start, min(start + chunk_size, n_rows))
+            data_array = np.column_stack([np.full(len(index), beta), np.full(len(index), theta),
+                                          x[index % len(x)] / width, y[index // len(x)] / length])
+            yield start, data_array
+
+    def store(result):
+        start, results = result
+        for kind, values in results.items():
+            field[kind].reshape(-1)[start:start + len(values)] = values
+
+    map_bounded(_run_chunk, ((start, data_array, kinds, method, backend) for start, data_array in chunks()),
+                workers, preload, (kinds, method, backend), store)
+    return field
+
+
+def save_field_map(field, output_dir, images=True, levels=30):
+    """Write the field to ``output_dir/field_map.npz`` and, with ``images``, one contour plot per kind."""
+    os.makedirs(output_dir, exist_ok=True)
+    kinds = [kind for kind in KINDS if kind in field]
+    np.savez_compressed(os.path.join(output_dir, 'field_map.npz'), **field)
+    file_names = [os.path.join(output_dir, 'field_map.npz')]
+    if not images:
+        return file_names
+
+    # matplotlib is only needed for the images
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    for kind in kinds:
+        figure = Figure(dpi=120)
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        contours = ax.contourf(field['x'], field['y'], field[kind], levels=levels, cmap='viridis')
+        figure.colorbar(contours, ax=ax, label=LABELS[kind])
+        ax.set_aspect('equal')
+        ax.set_xlabel('Crack tip x [mm]')
+        ax.set_ylabel('Crack tip y [mm]')
+        ax.set_title(f'{LABELS[kind]} for β = {field["beta"]:g}°, θ = {field["theta"]:g}° ({field["method"]})')
+        file_name = os.path.join(output_dir, f'field_map_{kind}.png')
+        figure.savefig(file_name)
+        file_names.append(file_name)
+    return file_names
@@ -0,0 +1,144 @@
+"""Lightweight run statistics for model loading, inference, path generation and plotting.
+
+Instrumentation is off unless a ``RunStats`` object is active::
+
+    with collect() as stats:
+        draw_crack_path(...)
+    print(stats.summary())
+    stats.save_trace('trace.json')  # open in chrome://tracing or Perfetto
+
+While it is off, ``span`` returns a shared no-op context manager and ``count``
+returns immediately, so the hooks in the hot paths cost one context variable
+lookup. The active ``RunStats`` is held in a context variable, so runs collected
+concurrently in different threads stay separate; worker threads of a run record
+into it when they are started in a copy of its context (see ``ensemble._map``).
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+_active = contextvars.ContextVar('instrumentation_active', default=None)
+_NO_SPAN = nullcontext()
+
+
+class RunStats:
+    """Spans and counters of one run.
+
+    Time is attributed to categories by self time: a ``geometry`` span of a
+    path step that contains an ``inference`` span only counts the time spent
+    outside the model call. ``callback`` is called with every finished span.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.events = []
+        self.counters = Counter()
+        self.self_time = defaultdict(float)
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def span(self, name, category, **args):
+        return _Span(self, name, category, args)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        with self._lock:
+            events = list(self.events)
+            self_time = dict(self.self_time)
+            counters = dict(self.counters)
+        steps = [event['duration'] for event in events if event['name'] == 'step']
+        loads = {event['name']: event['duration'] for event in events if event['category'] == 'load'}
+        return {
+            'time_by_category': self_time,
+            'steps': len(steps),
+            'step_mean_s': sum(steps) / len(steps) if steps else 0.0,
+            'step_max_s': max(steps, default=0.0),
+            'model_load_s': loads,
+            'counters': counters,
+        }
+
+    def chrome_trace(self):
+        with self._lock:
+            events = list(self.events)
+        return {'traceEvents': [{
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': event['start'] * 1e6,
+            'dur': event['duration'] * 1e6,
+            'pid': os.getpid(),
+            'tid': event['thread'],
+            'args': event['args'],
+        } for event in events]}
+
+    def save_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+class _Span:
+    def __init__(self, stats, name, category, args):
+        self.stats = stats
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        stack = self.stats._local.__dict__.setdefault('stack', [])
+        stack.append(self)
+        self.children = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        stats = self.stats
+        stack = stats._local.stack
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        event = {'name': self.name, 'category': self.category, 'start': self.start - stats._origin,
+                 'duration': duration, 'thread': threading.get_ident(), 'args': self.args}
+        with stats._lock:
+            stats.self_time[self.category] += duration - self.children
+            stats.events.append(event)
+        if stats.callback is not None:
+            stats.callback(event)
+        return False
+
+
+def active():
+    return _active.get()
+
+
+def span(name, category, **args):
+    stats = _active.get()
+    if stats is None:
+        return _NO_SPAN
+    return stats.span(name, category, **args)
+
+
+def count(name, n=1):
+    stats = _active.get()
+    if stats is not None:
+        stats.count(name, n)
+
+
+@contextmanager
+def collect(stats=None, callback=None):
+    """Activate ``stats`` (a new ``RunStats`` by default) in the current context for the duration of the block."""
+    if stats is None:
+        stats = RunStats(callback)
+    token = _active.set(stats)
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
@@ -0,0 +1,157 @@
+"""Identification of the loading angle (and the initial crack length) from a measured crack path.
+
+Candidate paths are grown in lockstep with ``generate_points_batch``, so a
+whole set of candidates costs about as much as a single path::
+
+    result = fit_theta(measured, width=42, length=71.4, precrack=19, increment=1)
+    print(result['theta'], result['confidence_interval']['theta'])
+
+``measured`` holds (x, y) points in the coordinates of ``generate_points``:
+x along the initial crack from the specimen edge, y across it.
+"""
+import itertools
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from draw_based_on_models import generate_points_batch
+
+
+def path_distances(paths, measured):
+    """Distance of every measured point to every candidate path.
+
+    ``paths`` is an (M, S, 2) array padded with NaN like the one of
+    generate_points_batch and ``measured`` a (K, 2) array; returns (M, K).
+    """
+    start, end = paths[:, None, :-1], paths[:, None, 1:]
+    segment = end - start
+    offset = measured[None, :, None] - start
+    squared_length = np.sum(segment ** 2, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(np.sum(offset * segment, axis=-1) / squared_length, 0, 1)
+    distances = np.hypot(*np.moveaxis(offset - t[..., None] * segment, -1, 0))
+    # Padding segments of paths that ended early never count as the closest one
+    return np.min(np.where(np.isnan(distances), np.inf, distances), axis=-1)
+
+
+class _Objective:
+    """Sum of squared distances between the measured points and candidate paths, counting model evaluations."""
+
+    def __init__(self, measured, width, length, increment, method, backend):
+        self.measured = measured
+        self.width = width
+        self.length = length
+        self.increment = increment
+        self.method = method
+        self.backend = backend
+        self.model_evaluations = 0
+        self.paths_evaluated = 0
+
+    def paths(self, candidates):
+        theta, precrack = candidates.T
+        p2 = np.column_stack([precrack, np.zeros(len(candidates))])
+        points, lengths, _ = generate_points_batch((0, 0), p2, theta, self.width, self.length, self.increment,
+                                                   self.method, self.backend)
+        # Every point after the initial crack tip took one model evaluation
+        self.model_evaluations += int(np.sum(lengths - 2))
+        self.paths_evaluated += len(candidates)
+        return points
+
+    def __call__(self, candidates):
+        candidates = np.atleast_2d(candidates)
+        return np.sum(path_distances(self.paths(candidates), self.measured) ** 2, axis=1)
+
+
+def _grid(center, half_width, n, lower, upper):
+    axes = [np.unique(np.clip(np.linspace(c - h, c + h, n if h > 0 else 1), low, high))
+            for c, h, low, high in zip(center, half_width, lower, upper)]
+    return np.array(list(itertools.product(*axes)))
+
+
+def _hessian(objective, center, steps, free):
+    """Central-difference Hessian of the objective over the free parameters, from one batch of paths."""
+    p = len(free)
+    offsets = [np.zeros(2)]
+    for i in free:
+        for sign in (1, -1):
+            offset = np.zeros(2)
+            offset[i] = sign * steps[i]
+            offsets.append(offset)
+    for i, j in itertools.combinations(free, 2):
+        for sign_i, sign_j in itertools.product((1, -1), repeat=2):
+            offset = np.zeros(2)
+            offset[i], offset[j] = sign_i * steps[i], sign_j * steps[j]
+            offsets.append(offset)
+    values = objective(center + np.array(offsets))
+    hessian = np.empty((p, p))
+    for a, i in enumerate(free):
+        hessian[a, a] = (values[1 + 2 * a] - 2 * values[0] + values[2 + 2 * a]) / steps[i] ** 2
+    for n, (a, b) in enumerate(itertools.combinations(range(p), 2)):
+        plus_plus, plus_minus, minus_plus, minus_minus = values[1 + 2 * p + 4 * n:5 + 2 * p + 4 * n]
+        hessian[a, b] = hessian[b, a] = ((plus_plus - plus_minus - minus_plus + minus_minus)
+                                         / (4 * steps[free[a]] * steps[free[b]]))
+    return values[0], hessian
+
+
+def fit_theta(measured, width=42, length=71.4, precrack=19, increment=1, method='DNN', backend='keras',
+              fit_precrack=False, theta_bounds=(0, 90), precrack_bounds=None, n_grid=19, n_refine=9,
+              tolerance=0.01, hessian_steps=(0.5, 0.25), confidence=0.95):
+    """Fit the loading angle theta (and optionally the initial crack length) to measured crack path points.
+
+    A coarse grid of ``n_grid`` values per fitted parameter brackets the
+    minimum of the summed squared point-to-path distances. The bracket is
+    then narrowed by rounds of ``n_refine`` candidates per parameter around
+    the best one until it is smaller than ``tolerance`` (degrees, mm); every
+    grid and every round is one batch of paths. The confidence interval
+    follows from the curvature of the objective at the minimum and the
+    residual variance of the fit.
+    """
+    measured = np.asarray(measured, dtype=np.float64).reshape(-1, 2)
+    objective = _Objective(measured, width, length, increment, method, backend)
+    if precrack_bounds is None:
+        precrack_bounds = (precrack - 2, precrack + 2)
+    lower = np.array([theta_bounds[0], precrack_bounds[0] if fit_precrack else precrack])
+    upper = np.array([theta_bounds[1], precrack_bounds[1] if fit_precrack else precrack])
+    free = [0, 1] if fit_precrack else [0]
+
+    # Coarse grid over the whole range
+    candidates = _grid((lower + upper) / 2, (upper - lower) / 2, n_grid, lower, upper)
+    values = objective(candidates)
+    best = candidates[np.argmin(values)]
+    half_width = (upper - lower) / (n_grid - 1)
+
+    # Batched refinement inside the bracket around the best candidate
+    while np.any(half_width[free] > tolerance):
+        candidates = _grid(best, half_width, n_refine, lower, upper)
+        values = objective(candidates)
+        best = candidates[np.argmin(values)]
+        half_width = half_width * 2 / (n_refine - 1)
+
+    steps = np.asarray(hessian_steps, dtype=np.float64)
+    sum_of_squares, hessian = _hessian(objective, best, steps, free)
+    degrees_of_freedom = max(1, len(measured) - len(free))
+    residual_variance = sum_of_squares / degrees_of_freedom
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    try:
+        covariance = 2 * residual_variance * np.linalg.inv(hessian)
+    except np.linalg.LinAlgError:
+        covariance = np.full_like(hessian, np.nan)
+    names = ['theta', 'precrack']
+    interval = {}
+    for a, i in enumerate(free):
+        # A flat or concave objective leaves the parameter undetermined
+        variance = covariance[a, a] if covariance[a, a] > 0 else math.inf
+        interval[names[i]] = (float(best[i] - z * math.sqrt(variance)), float(best[i] + z * math.sqrt(variance)))
+
+    path = objective.paths(best[None])[0]
+    return {
+        'theta': float(best[0]),
+        'precrack': float(best[1]),
+        'confidence_interval': interval,
+        'confidence': confidence,
+        'rms_distance': math.sqrt(sum_of_squares / len(measured)),
+        'model_evaluations': objective.model_evaluations,
+        'paths_evaluated': objective.paths_evaluated,
+        'path': path[~np.isnan(path[:, 0])],
+    }
@@ -0,0 +1,89 @@
+"""Export of the DNN models to a compact format that loads without Keras.
+
+Every model becomes a JSON manifest (layer shapes, activations, compute
+dtypes, the folded MinMaxScaler, SHA-256 checksums and the sizes of the
+source pickles) and one flat float32 ``.npy`` file with all weights, next to
+the pickles in MODELS/::
+
+    python model_artifacts.py export
+    python model_artifacts.py verify
+
+``numpy_inference.get_network`` memory-maps the weights of an exported model
+instead of unpickling it, so the ``numpy`` backend starts without importing
+Keras, and processes using the same model share the mapped pages. It falls
+back to the pickle with a warning when the size of the pickle changed after
+the export; ``verify`` also detects changes of the same size by checksum.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from model_registry import KINDS, compact_model_path, model_path, registry, resolve_version, scaler_path
+from numpy_inference import DenseNetwork, _sha256
+
+
+def _source(path):
+    return {'file': os.path.basename(path), 'sha256': _sha256(path), 'size': os.path.getsize(path)}
+
+
+def export_model(kind, version=None):
+    """Convert the pickled Keras model of ``kind`` and the DNN scaler; returns the written files."""
+    if version is None:
+        version = resolve_version(kind, 'DNN')
+    scaler = registry.get_scaler('DNN')
+    network = DenseNetwork.from_keras(registry.get_model(kind, 'DNN', version), scaler)
+    return network.save(
+        compact_model_path(kind, version),
+        kind=kind,
+        method='DNN',
+        version=version,
+        source=_source(model_path(kind, 'DNN', version)),
+        scaler_source={**_source(scaler_path('DNN')),
+                       'data_min': scaler.data_min_.tolist(), 'data_max': scaler.data_max_.tolist()},
+    )
+
+
+def verify_model(kind, version=None, n_points=1000, seed=0):
+    """Check the checksums of an export and, if its source pickle is present, that it predicts the same.
+
+    Returns the largest difference to the network converted from the pickle
+    (None without the pickle).
+    """
+    path = compact_model_path(kind, version)
+    network = DenseNetwork.load(path, verify=True)
+    with open(path) as file:
+        manifest = json.load(file)
+    source, scaler_source = (os.path.join(os.path.dirname(path), manifest[name]['file'])
+                             for name in ('source', 'scaler_source'))
+    if not os.path.exists(source):
+        return None
+    for name, file_name in [('source', source), ('scaler_source', scaler_source)]:
+        if _sha256(file_name) != manifest[name]['sha256']:
+            raise ValueError(f'{file_name} changed since {path} was exported; export it again')
+    low, high = manifest['scaler_source']['data_min'], manifest['scaler_source']['data_max']
+    data_array = np.random.default_rng(seed).uniform(low, high, size=(n_points, 4)).astype(np.float32)
+    converted = DenseNetwork.from_keras(registry.get_model(kind, 'DNN', manifest['version']),
+                                        registry.get_scaler('DNN'))
+    difference = float(np.max(np.abs(network.predict(data_array) - converted.predict(data_array))))
+    if difference > 0:
+        raise ValueError(f'{path} predicts differently from {source}: max difference {difference}')
+    return difference
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('export', 'verify'))
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    args = parser.parse_args(argv)
+    for kind in args.kinds:
+        if args.command == 'export':
+            print('\n'.join(export_model(kind)))
+        else:
+            difference = verify_model(kind)
+            print(f'{kind}: ok' + ('' if difference is None else ' (identical to the pickle)'))
+
+
+if __name__ == '__main__':
+    main()
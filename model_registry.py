@@ -0,0 +1,186 @@
+import os
+import threading
+from collections import OrderedDict
+
+import instrumentation
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MODELS')
+
+KINDS = ('Y1', 'Y2', 'angle', 'T', 'J')
+METHODS = ('DNN', 'XGBoost', 'TabNet')
+BACKENDS = ('keras', 'numpy', 'surrogate')
+
+# Versions of the trained models used for every kind and method
+VERSIONS = {
+    'Y1': {'XGBoost': 1, 'DNN': 1, 'TabNet': 5},
+    'Y2': {'XGBoost': 1, 'DNN': 4, 'TabNet': 6},
+    'angle': {'XGBoost': 8, 'DNN': 5, 'TabNet': 6},
+    'T': {'XGBoost': 3, 'DNN': 5, 'TabNet': 6},
+    'J': {'XGBoost': 1, 'DNN': 2, 'TabNet': 6},
+}
+
+
+def resolve_version(kind, method):
+    if method == 'XGBoost_T':
+        method = 'XGBoost'
+    return VERSIONS[kind][method]
+
+
+def model_path(kind, method, version=None):
+    if version is None:
+        version = resolve_version(kind, method)
+    if method == 'DNN':
+        file_name = f'model_{kind}_nn_optuna_ver{version}.pkl'
+    elif method in ('XGBoost', 'XGBoost_T'):
+        file_name = f'model_{kind}_XGBoost_ver{version}.pkl'
+    elif method == 'TabNet':
+        file_name = f'model_{kind}_tabnet_ver{version}.pkl'
+    else:
+        raise ValueError(f'Unknown method: {method}')
+    return os.path.join(MODELS_DIR, file_name)
+
+
+def compact_model_path(kind, version=None):
+    """Manifest of the compact export of a DNN model (see model_artifacts.py)."""
+    if version is None:
+        version = resolve_version(kind, 'DNN')
+    return os.path.join(MODELS_DIR, f'model_{kind}_nn_optuna_ver{version}.json')
+
+
+def scaler_path(method):
+    if method == 'DNN':
+        return os.path.join(MODELS_DIR, 'scaler_angle_nn_optuna_ver5.pkl')
+    if method == 'XGBoost_T':
+        return os.path.join(MODELS_DIR, 'scaler_xgb_t.pkl')
+    return None
+
+
+def load_artifact(path):
+    # joblib (and through the pickles Keras, xgboost or pytorch-tabnet) is only
+    # imported when the first artifact is actually loaded
+    import joblib
+
+    return joblib.load(path)
+
+
+def _key_name(key):
+    if isinstance(key, tuple):
+        return ' '.join(_key_name(part) for part in key)
+    return os.path.basename(str(key))
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded model artifacts.
+
+    Every artifact is loaded once and kept resident until it is evicted by the
+    LRU policy: when more than ``max_entries`` artifacts are cached, or their
+    total size (estimated from the artifact files) exceeds ``max_bytes``, the
+    least recently used ones are dropped first.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading = {}
+
+    def get(self, key, loader, size=0):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different artifacts load in parallel
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+            with instrumentation.span(f'load {_key_name(key)}', 'load'):
+                artifact = loader()
+            instrumentation.count('model_loads')
+            with self._lock:
+                self._entries[key] = (artifact, size)
+                self._loading.pop(key, None)
+                self._evict()
+        return artifact
+
+    def get_model(self, kind, method, version=None):
+        path = model_path(kind, method, version)
+        return self.get(path, lambda: load_artifact(path), os.path.getsize(path))
+
+    def get_scaler(self, method):
+        path = scaler_path(method)
+        if path is None:
+            return None
+        return self.get(path, lambda: load_artifact(path), os.path.getsize(path))
+
+    def warm_up(self, kinds=KINDS, methods=('DNN',)):
+        for method in methods:
+            self.get_scaler(method)
+            for kind in kinds:
+                if os.path.exists(model_path(kind, method)):
+                    self.get_model(kind, method)
+
+    def cached_bytes(self):
+        with self._lock:
+            return sum(size for _, size in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.cached_bytes() > self.max_bytes)):
+            self._entries.popitem(last=False)
+
+
+registry = ModelRegistry()
+
+
+def uses_pickled_model(method, backend):
+    """Whether ``backend`` evaluates the pickled model of ``method`` rather than a NumPy network or surrogate grid."""
+    return not (backend == 'surrogate' or (backend == 'numpy' and method == 'DNN'))
+
+
+def load_predictor(kind, method, backend='keras', version=None):
+    """The object whose ``predict`` evaluates ``kind`` with ``method`` on ``backend``.
+
+    NumPy networks and surrogate grids take raw (beta, theta, x/W, y/L) rows
+    and return (N, 1) arrays; pickled models take the rows as they were
+    trained on (see ``scaler_path``).
+    """
+    # Both modules import this one, so they are imported on first use
+    if backend == 'surrogate':
+        from surrogate_grid import get_surrogate
+
+        return get_surrogate(kind, method, version)
+    if not uses_pickled_model(method, backend):
+        from numpy_inference import get_network
+
+        return get_network(kind, version)
+    return registry.get_model(kind, method, version)
+
+
+def preload(kinds=KINDS, method='DNN', backend='keras'):
+    """Load everything ``backend`` needs to evaluate ``kinds`` with ``method``.
+
+    Used as the initializer of worker processes, so every worker loads its
+    models once and keeps them for all its chunks.
+    """
+    for kind in kinds:
+        load_predictor(kind, method, backend)
+    if uses_pickled_model(method, backend):
+        registry.get_scaler(method)
@@ -0,0 +1,220 @@
+"""Monte Carlo propagation of geometry and load tolerances to the crack path.
+
+Every sampled specimen gets its own crack path, but only running statistics
+are kept: the mean and standard deviation of the path on a fixed grid of x
+positions, histograms from which percentile bands are read, and the
+distribution of the position where the crack leaves the ligament. Memory use
+therefore does not grow with the number of samples::
+
+    result = run_monte_carlo({'theta': ('normal', 45, 1), 'precrack': ('uniform', 18.5, 19.5)},
+                             n_samples=100000, seed=1)
+
+Every chunk of samples draws from its own random stream spawned from
+``seed``, so the result does not depend on the number of workers.
+"""
+import numpy as np
+
+from draw_based_on_models import generate_points_batch
+from model_registry import preload
+from worker_pool import map_bounded
+
+# Sampled inputs and their nominal values from the crack path screen
+INPUTS = {
+    'theta': 45,
+    'precrack': 19,
+    'width': 42,
+    'length': 71.4,
+    'increment': 2,
+}
+
+
+# Parameters of every distribution, in the order they are given
+DISTRIBUTIONS = {
+    'normal': ('mean', 'std'),
+    'uniform': ('low', 'high'),
+    'triangular': ('low', 'mode', 'high'),
+}
+
+
+def _parameters(distribution):
+    kind, *parameters = distribution
+    if kind not in DISTRIBUTIONS:
+        raise ValueError(f'Unknown distribution: {kind}')
+    names = DISTRIBUTIONS[kind]
+    if len(parameters) != len(names):
+        raise ValueError(f'A {kind} distribution takes {len(names)} parameters ({", ".join(names)}), '
+                         f'got {len(parameters)}')
+    return kind, parameters
+
+
+def _nominal(distribution):
+    if np.isscalar(distribution):
+        return float(distribution)
+    kind, parameters = _parameters(distribution)
+    if kind == 'normal':
+        return parameters[0]
+    if kind == 'uniform':
+        return (parameters[0] + parameters[1]) / 2
+    return parameters[1]
+
+
+def sample_inputs(distributions, n_samples, rng):
+    """Draw ``n_samples`` values of every input.
+
+    A distribution is a number (kept fixed), ``('normal', mean, std)``,
+    ``('uniform', low, high)`` or ``('triangular', low, mode, high)``;
+    inputs that are not given keep their nominal value.
+    """
+    unknown = set(distributions) - set(INPUTS)
+    if unknown:
+        raise ValueError(f'Unknown Monte Carlo inputs: {", ".join(sorted(unknown))}')
+    samples = {}
+    for name, nominal in INPUTS.items():
+        distribution = distributions.get(name, nominal)
+        if np.isscalar(distribution):
+            samples[name] = np.full(n_samples, float(distribution))
+            continue
+        kind, parameters = _parameters(distribution)
+        if kind == 'normal':
+            samples[name] = rng.normal(*parameters, size=n_samples)
+        elif kind == 'uniform':
+            samples[name] = rng.uniform(*parameters, size=n_samples)
+        else:
+            samples[name] = rng.triangular(*parameters, size=n_samples)
+    return samples
+
+
+class PathStatistics:
+    """Running statistics of crack paths on a fixed grid of x positions.
+
+    Positions are in the coordinates of ``generate_points``; ``y_bins`` are
+    the edges of the histograms used for the percentile bands and the exit
+    position, values outside of them are counted in the outermost bins.
+    """
+
+    def __init__(self, x_grid, y_bins):
+        self.x_grid = np.asarray(x_grid, dtype=np.float64)
+        self.y_bins = np.asarray(y_bins, dtype=np.float64)
+        n_bins = len(self.y_bins) - 1
+        self.n_paths = 0
+        self.count = np.zeros(len(self.x_grid), dtype=np.int64)
+        self.sum = np.zeros(len(self.x_grid))
+        self.sum_of_squares = np.zeros(len(self.x_grid))
+        self.histogram = np.zeros((len(self.x_grid), n_bins), dtype=np.int64)
+        self.exit_count = 0
+        self.exit_sum = 0.0
+        self.exit_sum_of_squares = 0.0
+        self.exit_histogram = np.zeros(n_bins, dtype=np.int64)
+
+    def _bin(self, y):
+        return np.clip(np.searchsorted(self.y_bins, y, side='right') - 1, 0, len(self.y_bins) - 2)
+
+    def update(self, points, lengths, width):
+        """Add the paths of generate_points_batch, each ending at its specimen width."""
+        n_bins = len(self.y_bins) - 1
+        width = np.broadcast_to(width, lengths.shape)
+        cells = []
+        for path, n, w in zip(points, lengths, width):
+            path = path[1:n]
+            inside = path[:, 0] <= w
+            if inside.all():
+                exit_y = None
+            else:
+                # Interpolate where the last segment crosses the ligament edge
+                i = np.argmin(inside)
+                (x0, y0), (x1, y1) = path[i - 1], path[i]
+                exit_y = y0 + (y1 - y0) * (w - x0) / (x1 - x0)
+            reached = (self.x_grid >= path[0, 0]) & (self.x_grid <= min(w, path[:, 0].max()))
+            order = np.argsort(path[:, 0])
+            y = np.interp(self.x_grid[reached], path[order, 0], path[order, 1])
+            self.count[reached] += 1
+            self.sum[reached] += y
+            self.sum_of_squares[reached] += y ** 2
+            cells.append(np.flatnonzero(reached) * n_bins + self._bin(y))
+            if exit_y is not None:
+                self.exit_count += 1
+                self.exit_sum += exit_y
+                self.exit_sum_of_squares += exit_y ** 2
+                self.exit_histogram[self._bin(exit_y)] += 1
+        if cells:
+            self.histogram += np.bincount(np.concatenate(cells), minlength=self.histogram.size).reshape(
+                self.histogram.shape)
+        self.n_paths += len(lengths)
+
+    def merge(self, other):
+        for name in ('n_paths', 'count', 'sum', 'sum_of_squares', 'histogram', 'exit_count', 'exit_sum',
+                     'exit_sum_of_squares', 'exit_histogram'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    def percentiles(self, q):
+        """Percentile ``q`` of y at every grid position, interpolated within the histogram bins."""
+        cumulative = np.cumsum(self.histogram, axis=1)
+        target = q / 100 * cumulative[:, -1]
+        index = np.minimum(np.sum(cumulative < target[:, None], axis=1), self.histogram.shape[1] - 1)
+        rows = np.arange(len(index))
+        before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0)
+        in_bin = self.histogram[rows, index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(in_bin > 0, (target - before) / in_bin, 0)
+        values = self.y_bins[index] + fraction * np.diff(self.y_bins)[index]
+        return np.where(cumulative[:, -1] > 0, values, np.nan)
+
+    def result(self, percentiles=(5, 50, 95)):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum / self.count
+            std = np.sqrt(np.maximum(self.sum_of_squares / self.count - mean ** 2, 0))
+            exit_count = self.exit_count or np.nan
+            exit_mean = self.exit_sum / exit_count
+            exit_std = np.sqrt(np.maximum(self.exit_sum_of_squares / exit_count - exit_mean ** 2, 0))
+        return {
+            'n_samples': self.n_paths,
+            'x': self.x_grid,
+            'count': self.count,
+            'mean': mean,
+            'std': std,
+            'percentiles': {q: self.percentiles(q) for q in percentiles},
+            'exit': {
+                'count': self.exit_count,
+                'mean': exit_mean,
+                'std': exit_std,
+                'histogram': self.exit_histogram,
+                'bin_edges': self.y_bins,
+            },
+        }
+
+
+def _run_chunk(seed, n_samples, distributions, method, backend, x_grid, y_bins, max_steps):
+    samples = sample_inputs(distributions, n_samples, np.random.default_rng(seed))
+    p2 = np.column_stack([samples['precrack'], np.zeros(n_samples)])
+    points, lengths, _ = generate_points_batch((0, 0), p2, samples['theta'], samples['width'], samples['length'],
+                                               samples['increment'], method, backend, max_steps)
+    stats = PathStatistics(x_grid, y_bins)
+    stats.update(points, lengths, samples['width'])
+    return stats
+
+
+def run_monte_carlo(distributions, n_samples=10000, seed=0, method='DNN', backend='keras', chunk_size=1000,
+                    workers=None, x_grid=None, y_bins=None, percentiles=(5, 50, 95), max_steps=1000):
+    """Sample the inputs, grow a crack path for every sample and return the path statistics.
+
+    By default ``x_grid`` runs from the nominal initial crack length to the
+    nominal width in 100 intervals and ``y_bins`` covers the nominal specimen
+    length in 0.05 mm bins. ``max_steps`` bounds the steps of every path, so
+    samples with very small increments cannot stall the run. ``workers=0``
+    runs everything in the calling process.
+    """
+    nominal = {name: _nominal(distributions.get(name, value)) for name, value in INPUTS.items()}
+    if x_grid is None:
+        x_grid = np.linspace(nominal['precrack'], nominal['width'], 101)
+    if y_bins is None:
+        y_bins = np.arange(-nominal['length'] / 2, nominal['length'] / 2 + 0.05, 0.05)
+    chunk_sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    arguments = [(chunk_seed, size, distributions, method, backend, x_grid, y_bins, max_steps)
+                 for chunk_seed, size in zip(seeds, chunk_sizes)]
+
+    stats = PathStatistics(x_grid, y_bins)
+    # Chunks are merged in order, so the sums are identical for any number of workers
+    map_bounded(_run_chunk, arguments, workers, preload, (('angle',), method, backend), stats.merge)
+    return stats.result(percentiles)
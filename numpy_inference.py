@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+
+from model_registry import KINDS, compact_model_path, model_path, registry, resolve_version
+
+# Version of the manifest written by DenseNetwork.save
+FORMAT_VERSION = 1
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    'softplus': lambda x: np.logaddexp(x, 0),
+}
+
+
+class DenseNetwork:
+    """Forward pass of a stack of dense layers in plain NumPy.
+
+    The MinMaxScaler of the DNN models is folded in, so ``predict`` takes raw
+    (beta, theta, x/W, y/L) rows and returns an (N, 1) array like Keras does.
+    Layers trained with the ``mixed_float16`` policy are evaluated in float16
+    precision with float32 accumulation to reproduce the Keras outputs.
+    ``rounded`` float32 arrays already hold values of their compute dtype and
+    are used without a copy, so memory-mapped weights stay shared.
+    """
+
+    def __init__(self, weights, biases, activations, scaler_min=None, scaler_scale=None, compute_dtypes=None,
+                 rounded=False):
+        self.compute_dtypes = [np.dtype(dtype) for dtype in (compute_dtypes or ['float32'] * len(weights))]
+        if rounded:
+            self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+            self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        else:
+            self.weights = [np.asarray(w, dtype=dtype).astype(np.float32)
+                            for w, dtype in zip(weights, self.compute_dtypes)]
+            self.biases = [np.asarray(b, dtype=dtype).astype(np.float32)
+                           for b, dtype in zip(biases, self.compute_dtypes)]
+        self.activations = list(activations)
+        self.scaler_min = None if scaler_min is None else np.asarray(scaler_min, dtype=np.float32)
+        self.scaler_scale = None if scaler_scale is None else np.asarray(scaler_scale, dtype=np.float32)
+        for activation in self.activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f'Unsupported activation: {activation}')
+
+    @classmethod
+    def from_keras(cls, model, scaler=None):
+        weights, biases, activations, compute_dtypes = [], [], [], []
+        for layer in model.layers:
+            if layer.__class__.__name__ != 'Dense':
+                raise ValueError(f'Unsupported layer type: {layer.__class__.__name__}')
+            layer_weights = layer.get_weights()
+            weights.append(layer_weights[0])
+            biases.append(layer_weights[1] if len(layer_weights) > 1 else np.zeros(layer_weights[0].shape[1]))
+            activations.append(getattr(layer.activation, '__name__', str(layer.activation)))
+            compute_dtypes.append(layer.dtype_policy.compute_dtype)
+        if scaler is None:
+            return cls(weights, biases, activations, compute_dtypes=compute_dtypes)
+        return cls(weights, biases, activations, scaler.min_, scaler.scale_, compute_dtypes)
+
+    @classmethod
+    def load(cls, path, verify=False):
+        """Load a network saved by ``save``; the weights are memory-mapped, not read.
+
+        With ``verify`` the checksum of the weight file is checked as well.
+        """
+        with open(path) as file:
+            manifest = json.load(file)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f'{path}: unsupported format version {manifest.get("format_version")}')
+        weights_path = os.path.join(os.path.dirname(path), manifest['weights']['file'])
+        if verify and _sha256(weights_path) != manifest['weights']['sha256']:
+            raise ValueError(f'{weights_path} does not match the checksum in {path}')
+        blob = np.load(weights_path, mmap_mode='r')
+        if blob.dtype != np.float32 or blob.shape != (manifest['weights']['size'],):
+            raise ValueError(f'{weights_path} does not match the layout in {path}')
+
+        def array(offset, shape):
+            # A view of the mapped file; no data is read until it is used
+            return np.asarray(blob[offset:offset + int(np.prod(shape))]).reshape(shape)
+
+        layers = manifest['layers']
+        scaler = manifest.get('scaler')
+        return cls([array(layer['weights_offset'], (layer['inputs'], layer['units'])) for layer in layers],
+                   [array(layer['bias_offset'], (layer['units'],)) for layer in layers],
+                   [layer['activation'] for layer in layers],
+                   None if scaler is None else scaler['min'], None if scaler is None else scaler['scale'],
+                   [layer['compute_dtype'] for layer in layers], rounded=True)
+
+    def save(self, path, **metadata):
+        """Write a JSON manifest to ``path`` and the weights as one flat float32 .npy file next to it."""
+        weights_path = os.path.splitext(path)[0] + '.npy'
+        layers = []
+        parts = []
+        offset = 0
+        for weights, biases, activation, dtype in zip(self.weights, self.biases, self.activations,
+                                                      self.compute_dtypes):
+            layers.append({'inputs': weights.shape[0], 'units': weights.shape[1], 'activation': activation,
+                           'compute_dtype': dtype.name, 'weights_offset': offset, 'bias_offset': offset + weights.size})
+            parts.extend([weights.reshape(-1), biases.reshape(-1)])
+            offset += weights.size + biases.size
+        blob = np.concatenate(parts).astype(np.float32)
+        np.save(weights_path, blob)
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            **metadata,
+            'layers': layers,
+            'weights': {'file': os.path.basename(weights_path), 'dtype': 'float32', 'size': int(blob.size),
+                        'sha256': _sha256(weights_path)},
+        }
+        if self.scaler_scale is not None:
+            manifest['scaler'] = {'min': self.scaler_min.tolist(), 'scale': self.scaler_scale.tolist()}
+        with open(path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+            file.write('\n')
+        return [path, weights_path]
+
+    def predict(self, data_array):
+        hidden = np.asarray(data_array, dtype=np.float32).reshape(-1, self.weights[0].shape[0])
+        if self.scaler_scale is not None:
+            hidden = hidden * self.scaler_scale + self.scaler_min
+        for weights, biases, activation, dtype in zip(self.weights, self.biases, self.activations,
+                                                      self.compute_dtypes):
+            if dtype != np.float32:
+                hidden = (hidden.astype(dtype).astype(np.float32) @ weights + biases).astype(dtype)
+                hidden = ACTIVATIONS[activation](hidden).astype(np.float32)
+            else:
+                hidden = ACTIVATIONS[activation](hidden @ weights + biases)
+        return hidden
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def changed_sources(manifest_path):
+    """Source pickles of a compact export whose size differs from the one recorded at the export.
+
+    Only the size is compared, so loading an export reads no more than the
+    manifest; ``model_artifacts.py verify`` compares the checksums. Missing
+    sources and exports without recorded sizes are not checked.
+    """
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    changed = []
+    for source in (manifest['source'], manifest['scaler_source']):
+        path = os.path.join(os.path.dirname(manifest_path), source['file'])
+        if 'size' in source and os.path.exists(path) and os.path.getsize(path) != source['size']:
+            changed.append(path)
+    return changed
+
+
+def get_network(kind, version=None):
+    """The NumPy network of a DNN model.
+
+    The compact export (see model_artifacts.py) is memory-mapped when it
+    exists, so neither joblib nor Keras is imported; otherwise the network is
+    converted from the Keras model. An export whose source pickles changed
+    since it was written is not used: the network is converted from the
+    pickles with a warning instead.
+    """
+    if version is None:
+        version = resolve_version(kind, 'DNN')
+    compact_path = compact_model_path(kind, version)
+    path = model_path(kind, 'DNN', version)
+
+    def convert():
+        return DenseNetwork.from_keras(registry.get_model(kind, 'DNN', version), registry.get_scaler('DNN'))
+
+    if os.path.exists(compact_path):
+        def load():
+            changed = changed_sources(compact_path)
+            if not changed:
+                return DenseNetwork.load(compact_path)
+            warnings.warn(f'{", ".join(changed)} changed since {compact_path} was exported; using the pickled '
+                          f'model instead. Update the export with "python model_artifacts.py export"')
+            return convert()
+
+        return registry.get(('numpy', compact_path), load,
+                            os.path.getsize(os.path.splitext(compact_path)[0] + '.npy'))
+    return registry.get(('numpy', path), convert)
+
+
+def has_network(kind, version=None):
+    return os.path.exists(compact_model_path(kind, version)) or os.path.exists(model_path(kind, 'DNN', version))
+
+
+def check_parity(kinds=KINDS, n_points=1000, seed=0, rtol=2e-3, atol=1e-4):
+    """Compare the NumPy forward pass with Keras on random points in the training range.
+
+    Returns a dict mapping every kind to the maximum absolute difference and
+    raises AssertionError if any output differs by more than ``rtol`` times
+    its Keras value plus ``atol``. The default ``rtol`` is two float16 units
+    of the last place, the rounding of the hidden layers; ``atol`` covers
+    outputs close to zero.
+    """
+    scaler = registry.get_scaler('DNN')
+    rng = np.random.default_rng(seed)
+    data_array = rng.uniform(scaler.data_min_, scaler.data_max_, size=(n_points, 4)).astype(np.float32)
+    differences = {}
+    for kind in kinds:
+        model = registry.get_model(kind, 'DNN')
+        expected = model.predict(scaler.transform(data_array), verbose=0)
+        actual = get_network(kind).predict(data_array)
+        differences[kind] = float(np.max(np.abs(actual - expected)))
+        tolerance = atol + rtol * np.abs(expected)
+        if np.any(np.abs(actual - expected) > tolerance):
+            raise AssertionError(f'NumPy and Keras outputs differ for {kind}: max difference {differences[kind]}')
+    return differences
+
+
+if __name__ == '__main__':
+    for kind, difference in check_parity().items():
+        print(f'{kind}: max difference {difference:.3g}')
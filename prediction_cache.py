@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'cts', 'predictions.sqlite')
+# SQLite limits the number of parameters of one statement
+_QUERY_CHUNK = 500
+# Number of cache hits whose access time is kept in memory before it is written
+_USED_FLUSH = 10_000
+
+
+class PredictionCache:
+    """Persistent cache of model predictions in an SQLite database.
+
+    Entries are keyed by model kind, method, backend, version and the input
+    row quantized to multiples of ``quantum`` (a scalar or one value per
+    input). Entries of other versions of a model are dropped the first time
+    the model is used, and the least recently used entries are evicted when
+    the cache holds more than ``max_entries``. The database runs in WAL mode,
+    so several processes can share one file.
+
+    The number of entries is kept in the ``metadata`` table by triggers, so a
+    store does not count the table. Access times of hits are collected in
+    memory and written with the next store (or every ``_USED_FLUSH`` hits and
+    on ``close``), so a lookup does not write to the database.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, quantum=1e-6, max_entries=1_000_000):
+        self.path = path
+        self.quantum = np.broadcast_to(np.asarray(quantum, dtype=np.float64), (4,))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._checked_versions = set()
+        self._used = {}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._transaction():
+            self._connection.execute('CREATE TABLE IF NOT EXISTS predictions ('
+                                     'kind TEXT, method TEXT, backend TEXT, version INTEGER, inputs TEXT, '
+                                     'value REAL, used REAL, PRIMARY KEY (kind, method, backend, version, inputs))')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value INTEGER)')
+            # Counted once for databases created before the counter existed
+            self._connection.execute("INSERT OR IGNORE INTO metadata SELECT 'entries', COUNT(*) FROM predictions")
+            self._connection.execute("CREATE TRIGGER IF NOT EXISTS predictions_insert AFTER INSERT ON predictions "
+                                     "BEGIN UPDATE metadata SET value = value + 1 WHERE name = 'entries'; END")
+            self._connection.execute("CREATE TRIGGER IF NOT EXISTS predictions_delete AFTER DELETE ON predictions "
+                                     "BEGIN UPDATE metadata SET value = value - 1 WHERE name = 'entries'; END")
+
+    def keys(self, data_array):
+        quantized = np.round(np.asarray(data_array, dtype=np.float64).reshape(-1, 4) / self.quantum).astype(np.int64)
+        return [' '.join(map(str, row)) for row in quantized]
+
+    def lookup(self, kind, method, backend, version, data_array):
+        """Return cached values for the rows of ``data_array``, NaN where there is no entry."""
+        keys = self.keys(data_array)
+        values = np.full(len(keys), np.nan)
+        with self._lock:
+            self._drop_other_versions(kind, method, backend, version)
+            found = {}
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = list(set(keys[start:start + _QUERY_CHUNK]))
+                rows = self._connection.execute(
+                    f'SELECT inputs, value FROM predictions WHERE kind = ? AND method = ? AND backend = ? '
+                    f'AND version = ? AND inputs IN ({",".join("?" * len(chunk))})',
+                    [kind, method, backend, version, *chunk]).fetchall()
+                found.update(rows)
+            now = time.time()
+            self._used.update(((kind, method, backend, version, key), now) for key in found)
+            if len(self._used) >= _USED_FLUSH:
+                with self._transaction():
+                    self._flush_used()
+            for i, key in enumerate(keys):
+                if key in found:
+                    values[i] = found[key]
+            n_hits = int(np.count_nonzero(~np.isnan(values)))
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+        return values
+
+    def store(self, kind, method, backend, version, data_array, values):
+        now = time.time()
+        rows = [(kind, method, backend, version, key, float(value), now)
+                for key, value in zip(self.keys(data_array), values)]
+        with self._lock, self._transaction():
+            # An upsert instead of INSERT OR REPLACE: the replaced row would not fire the delete trigger
+            self._connection.executemany(
+                'INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (kind, method, backend, version, inputs) '
+                'DO UPDATE SET value = excluded.value, used = excluded.used', rows)
+            self._flush_used()
+            n_entries = self._entries()
+            if n_entries > self.max_entries:
+                # Evict down to 90 % of the limit so eviction does not run on every store
+                self._connection.execute(
+                    'DELETE FROM predictions WHERE rowid IN '
+                    '(SELECT rowid FROM predictions ORDER BY used LIMIT ?)',
+                    (n_entries - int(0.9 * self.max_entries),))
+
+    def stats(self):
+        with self._lock:
+            n_entries = self._entries()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': n_entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM predictions')
+
+    def close(self):
+        with self._lock:
+            if self._used:
+                with self._transaction():
+                    self._flush_used()
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+
+    def _entries(self):
+        return self._connection.execute("SELECT value FROM metadata WHERE name = 'entries'").fetchone()[0]
+
+    def _flush_used(self):
+        # Only raises access times: another process may have used the entry more recently
+        self._connection.executemany(
+            'UPDATE predictions SET used = max(used, ?) WHERE kind = ? AND method = ? AND backend = ? '
+            'AND version = ? AND inputs = ?', [(used, *key) for key, used in self._used.items()])
+        self._used.clear()
+
+    def _drop_other_versions(self, kind, method, backend, version):
+        if (kind, method, backend, version) in self._checked_versions:
+            return
+        self._connection.execute('DELETE FROM predictions WHERE kind = ? AND method = ? AND backend = ? '
+                                 'AND version != ?', (kind, method, backend, version))
+        self._checked_versions.add((kind, method, backend, version))
@@ -0,0 +1,253 @@
+"""Local HTTP service around the CTS models.
+
+Models are kept warm in the process, and concurrent requests for the same
+model are coalesced into one batched model call. Endpoints:
+
+- ``POST /predict`` with ``{"points": [[beta, theta, x/W, y/L], ...], "kinds": [...],
+  "method": "DNN", "backend": "keras"}``
+- ``POST /path`` with ``{"precrack": 19, "theta": 45, "width": 42, "length": 71.4,
+  "increment": 2, "method": "DNN", "backend": "keras"}``; optional ``max_steps``,
+  ``max_extension`` and the pin geometry ``vertical_distance``,
+  ``horizontal_distance`` and ``diameter`` add StopConditions
+- ``GET /metrics`` (uptime, requests and model rows per second, latency
+  percentiles and batch sizes) and ``GET /health``
+
+``backend`` defaults to the backend the server was started with.
+
+The server only listens on localhost or on a Unix socket.
+"""
+import asyncio
+import json
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from draw_based_on_models import StopConditions, advance_points, next_point_inputs
+from model_registry import BACKENDS, KINDS, METHODS, registry
+from numpy_inference import get_network
+from predictions_based_on_models import predict_rows
+
+MAX_PATH_STEPS = 10000
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ServerMetrics:
+    """Latency of the successful requests and throughput since the server started.
+
+    ``rows`` counts the rows evaluated by the models, so a ``/predict``
+    request adds one row per point and kind, and a ``/path`` request one per
+    crack increment.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.latencies = {}
+        self.batch_sizes = Counter()
+        self.requests = Counter()
+        self.rows = 0
+        self.max_samples = max_samples
+        self.started = time.monotonic()
+
+    def record_request(self, endpoint, seconds):
+        self.requests[endpoint] += 1
+        self.latencies.setdefault(endpoint, deque(maxlen=self.max_samples)).append(seconds)
+
+    def record_batch(self, size):
+        self.batch_sizes[size] += 1
+        self.rows += size
+
+    def summary(self):
+        latencies = {}
+        for endpoint, samples in self.latencies.items():
+            samples = np.array(samples) * 1000
+            latencies[endpoint] = {
+                'count': self.requests[endpoint],
+                'p50_ms': float(np.percentile(samples, 50)),
+                'p99_ms': float(np.percentile(samples, 99)),
+            }
+        n_batches = sum(self.batch_sizes.values())
+        n_requests = sum(self.requests.values())
+        uptime = time.monotonic() - self.started
+        return {
+            'uptime_s': uptime,
+            'requests': n_requests,
+            'requests_per_s': n_requests / uptime,
+            'rows': self.rows,
+            'rows_per_s': self.rows / uptime,
+            'latency': latencies,
+            'batches': n_batches,
+            'mean_batch_size': self.rows / n_batches if n_batches else 0.0,
+            'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
+
+
+class MicroBatcher:
+    """Collect rows for the same model for up to ``window`` seconds and evaluate them together."""
+
+    def __init__(self, metrics, window=0.002, max_batch=4096):
+        self.metrics = metrics
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._timers = {}
+
+    async def predict(self, kind, method, backend, data_array):
+        data_array = np.asarray(data_array, dtype=np.float32).reshape(-1, 4)
+        key = (kind, method, backend)
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((data_array, future))
+        if len(pending) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        elif sum(len(rows) for rows, _ in pending) >= self.max_batch:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key):
+        pending = self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if pending:
+            asyncio.ensure_future(self._run(key, pending))
+
+    async def _run(self, key, pending):
+        kind, method, backend = key
+        data_array = np.concatenate([rows for rows, _ in pending])
+        self.metrics.record_batch(len(data_array))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: predict_rows(kind, method, data_array, backend=backend))
+        except Exception as error:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for rows, future in pending:
+            if not future.done():
+                future.set_result(results[start:start + len(rows)])
+            start += len(rows)
+
+
+class PredictionServer:
+    def __init__(self, window=0.002, max_batch=4096, backend='keras'):
+        # Backend of requests that do not name one
+        self.backend = backend
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(self.metrics, window, max_batch)
+
+    async def predict(self, request):
+        points = np.asarray(request['points'], dtype=np.float64).reshape(-1, 4)
+        kinds = request.get('kinds', list(KINDS))
+        method = request.get('method', 'DNN')
+        backend = request.get('backend', self.backend)
+        _check_model(kinds, method, backend)
+        results = await asyncio.gather(*(self.batcher.predict(kind, method, backend, points) for kind in kinds))
+        return {kind: values.tolist() for kind, values in zip(kinds, results)}
+
+    async def path(self, request):
+        width = float(request.get('width', 42))
+        length = float(request.get('length', 71.4))
+        theta = float(request.get('theta', 45))
+        increment = float(request.get('increment', 2))
+        method = request.get('method', 'DNN')
+        backend = request.get('backend', self.backend)
+        _check_model(['angle'], method, backend)
+        diameter = request.get('diameter')
+        stop = StopConditions(
+            float(request.get('vertical_distance', 50.4)), float(request.get('horizontal_distance', 25.2)),
+            None if diameter is None else float(diameter),
+            max_extension=None if request.get('max_extension') is None else float(request['max_extension']),
+            max_steps=min(int(request.get('max_steps', MAX_PATH_STEPS)), MAX_PATH_STEPS))
+        previous = np.array([[0.0, 0.0]])
+        last = np.array([[float(request.get('precrack', 19)), 0.0]])
+        points = [previous[0].tolist(), last[0].tolist()]
+        extension = 0.0
+        reason = 'ligament_exit' if last[0, 0] >= width else ''
+        # Every step of every concurrent path goes through the batcher
+        while not reason:
+            data_array, angle_of_last_part = next_point_inputs(previous, last, theta, width, length)
+            new_angle = await self.batcher.predict('angle', method, backend, data_array)
+            previous, (last, _) = last, advance_points(last, angle_of_last_part, new_angle, increment)
+            points.append(last[0].tolist())
+            extension += float(np.hypot(*(last[0] - previous[0])))
+            reason = stop.check(previous, last, width, length, extension, len(points) - 2)[0]
+        return {'points': points, 'reason': reason}
+
+    async def handle(self, reader, writer):
+        started = time.perf_counter()
+        endpoint = None
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            if len(request_line) < 2:
+                writer.close()
+                return
+            http_method, endpoint = request_line[0], request_line[1].split('?')[0]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, response = await self.route(http_method, endpoint, body)
+        except Exception as error:
+            status, response = 500, {'error': str(error)}
+        payload = json.dumps(response).encode()
+        writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        if endpoint in ('/predict', '/path') and status == 200:
+            self.metrics.record_request(endpoint, time.perf_counter() - started)
+
+    async def route(self, http_method, endpoint, body):
+        if endpoint == '/health':
+            return 200, {'status': 'ok'}
+        if endpoint == '/metrics':
+            return 200, self.metrics.summary()
+        if endpoint not in ('/predict', '/path'):
+            return 404, {'error': f'Unknown endpoint: {endpoint}'}
+        if http_method != 'POST':
+            return 405, {'error': f'{endpoint} expects POST'}
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError as error:
+            return 400, {'error': f'Invalid JSON: {error}'}
+        try:
+            if endpoint == '/predict':
+                return 200, await self.predict(request)
+            return 200, await self.path(request)
+        except (KeyError, ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+
+
+def _check_model(kinds, method, backend):
+    if method not in METHODS:
+        raise ValueError(f'Unknown method: {method}')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    for kind in kinds:
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind: {kind}')
+
+
+async def serve(port=8765, unix_socket=None, window=0.002, max_batch=4096, methods=('DNN',), backend='keras'):
+    # Load the models before the first request arrives; with the numpy backend
+    # the DNN models are never unpickled, so Keras is not imported
+    if backend == 'numpy' and 'DNN' in methods:
+        for kind in KINDS:
+            get_network(kind)
+        methods = [method for method in methods if method != 'DNN']
+    registry.warm_up(methods=methods)
+    server = PredictionServer(window, max_batch, backend)
+    if unix_socket:
+        listener = await asyncio.start_unix_server(server.handle, path=unix_socket)
+    else:
+        listener = await asyncio.start_server(server.handle, host='127.0.0.1', port=port)
+    async with listener:
+        await listener.serve_forever()
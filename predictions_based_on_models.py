@@ -1,49 +1,125 @@
-import time
-
-import joblib
 import numpy as np
 
+import instrumentation
+from model_registry import KINDS, load_predictor, registry, resolve_version, uses_pickled_model
+from prediction_cache import DEFAULT_CACHE_PATH, PredictionCache
+
+
+DEFAULT_CHUNK_SIZE = 4096
+
+_cache = None
+
+
+def enable_cache(path=DEFAULT_CACHE_PATH, quantum=1e-6, max_entries=1_000_000):
+    """Cache all predictions in a persistent database shared by every caller."""
+    global _cache
+    disable_cache()
+    _cache = PredictionCache(path, quantum, max_entries)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def prediction_cache():
+    return _cache
+
 
-def predict_general(width, length, x_prev, y_prev, beta, theta, method, kind, version):
-    var = -1
+def predict_rows(kind, method, data_array, version=None, chunk_size=DEFAULT_CHUNK_SIZE, backend='keras'):
+    """Evaluate one model on an (N, 4) array of (beta, theta, x/W, y/L) rows.
+
+    With ``backend='numpy'`` the DNN models are evaluated by the pure-NumPy
+    forward pass instead of Keras; ``backend='surrogate'`` interpolates in
+    a precomputed grid of the model. When the cache is enabled only the rows
+    without a cached prediction are evaluated.
+    """
+    if version is None:
+        version = resolve_version(kind, method)
+    data_array = np.asarray(data_array, dtype=np.float32).reshape(-1, 4)
+    cache = _cache
+    if cache is None:
+        return _evaluate_rows(kind, method, data_array, version, chunk_size, backend)
+    results = cache.lookup(kind, method, backend, version, data_array)
+    missing = np.isnan(results)
+    instrumentation.count('cache_hits', len(results) - int(np.count_nonzero(missing)))
+    instrumentation.count('cache_misses', int(np.count_nonzero(missing)))
+    if missing.any():
+        results[missing] = _evaluate_rows(kind, method, data_array[missing], version, chunk_size, backend)
+        cache.store(kind, method, backend, version, data_array[missing], results[missing])
+    return results
+
+
+def _evaluate_rows(kind, method, data_array, version, chunk_size, backend):
+    instrumentation.count(f'model_calls/{kind}')
+    instrumentation.count(f'model_rows/{kind}', len(data_array))
+    with instrumentation.span(f'predict {kind}', 'inference', rows=len(data_array)):
+        return _evaluate_chunks(kind, method, data_array, version, chunk_size, backend)
+
+
+def _evaluate_chunks(kind, method, data_array, version, chunk_size, backend):
+    results = np.empty(len(data_array), dtype=np.float64)
+    if not uses_pickled_model(method, backend):
+        network = load_predictor(kind, method, backend, version)
+        for start in range(0, len(data_array), chunk_size):
+            chunk = data_array[start:start + chunk_size]
+            results[start:start + len(chunk)] = network.predict(chunk)[:, 0]
+        return results
+    loaded_scaler = registry.get_scaler(method)
+    loaded_model = registry.get_model(kind, method, version)
+    for start in range(0, len(data_array), chunk_size):
+        chunk = data_array[start:start + chunk_size]
+        if loaded_scaler is not None:
+            chunk = loaded_scaler.transform(chunk)
+        if method == 'DNN':
+            predicted = loaded_model.predict(chunk, batch_size=len(chunk), verbose=0)
+        elif method in ('XGBoost', 'XGBoost_T', 'TabNet'):
+            predicted = loaded_model.predict(chunk)
+        else:
+            raise ValueError(f'Unknown method: {method}')
+        results[start:start + len(chunk)] = np.asarray(predicted).reshape(len(chunk), -1)[:, 0]
+    return results
+
+
+def predict_batch(points, kinds=KINDS, method='DNN', chunk_size=DEFAULT_CHUNK_SIZE, versions=None, backend='keras'):
+    """Predict several fracture parameters for many crack-tip positions at once.
+
+    ``points`` is an (N, 4) array of (beta, theta, x/W, y/L) rows. Returns a
+    dict mapping every requested kind to an array of N predictions; each kind
+    is evaluated with one batched model call per ``chunk_size`` rows.
+    """
+    data_array = np.asarray(points, dtype=np.float32).reshape(-1, 4)
+    versions = versions or {}
+    return {kind: predict_rows(kind, method, data_array, versions.get(kind), chunk_size, backend)
+            for kind in kinds}
+
+
+def predict_general(width, length, x_prev, y_prev, beta, theta, method, kind, version=None, backend='keras'):
     pre_x = x_prev / width
     pre_y = y_prev / length
     data_point = [beta, theta, pre_x, pre_y]
     data_array = np.array(data_point, dtype=np.float32).reshape(1, -1)
-    if method == 'DNN':
-        # Load the scaler from the file
-        loaded_scaler = joblib.load(f'MODELS/scaler_angle_nn_optuna_ver5.pkl')
-        loaded_model = joblib.load(f'MODELS/model_{kind}_nn_optuna_ver{version}.pkl')
-        var = loaded_model.predict(loaded_scaler.transform(data_array))[0][0]
-    if method == 'XGBoost':
-        loaded_model = joblib.load(f'MODELS/model_{kind}_XGBoost_ver{version}.pkl')
-        var = loaded_model.predict(data_array)[0]
-    if method == 'XGBoost_T':
-        loaded_scaler = joblib.load(f'MODELS/scaler_xgb_t.pkl')
-        loaded_model = joblib.load(f'MODELS/model_{kind}_XGBoost_ver{version}.pkl')
-        var = loaded_model.predict(loaded_scaler.transform(data_array))[0]
-    if method == 'TabNet':
-        loaded_model = joblib.load(f'MODELS/model_{kind}_tabnet_ver{version}.pkl')
-        var = loaded_model.predict(data_array)[0][0]
-    return var
-
+    return predict_rows(kind, method, data_array, version, backend=backend)[0]
 
-def predict_Y1(width, length, x_prev, y_prev, beta, theta, method, version):
-    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'Y1', version)
 
+def predict_Y1(width, length, x_prev, y_prev, beta, theta, method, version=None, backend='keras'):
+    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'Y1', version, backend)
 
-def predict_Y2(width, length, x_prev, y_prev, beta, theta, method, version):
-    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'Y2', version)
 
+def predict_Y2(width, length, x_prev, y_prev, beta, theta, method, version=None, backend='keras'):
+    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'Y2', version, backend)
 
-def predict_angle(width, length, x_prev, y_prev, beta, theta, method, version):
-    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'angle', version)
 
+def predict_angle(width, length, x_prev, y_prev, beta, theta, method, version=None, backend='keras'):
+    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'angle', version, backend)
 
-def predict_T(width, length, x_prev, y_prev, beta, theta, method, version):
-    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'T', version)
 
+def predict_T(width, length, x_prev, y_prev, beta, theta, method, version=None, backend='keras'):
+    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'T', version, backend)
 
-def predict_J(width, length, x_prev, y_prev, beta, theta, method, version):
-    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'J', version)
 
+def predict_J(width, length, x_prev, y_prev, beta, theta, method, version=None, backend='keras'):
+    return predict_general(width, length, x_prev, y_prev, beta, theta, method, 'J', version, backend)
@@ -0,0 +1,129 @@
+"""Fast off-screen rendering of many crack paths on the same specimen.
+
+The specimen (outline, holes, grids and the initial crack) is drawn once per
+geometry and kept as a bitmap. A path is rendered by restoring that bitmap
+and drawing a single ``LineCollection`` on top, so no figure is rebuilt::
+
+    renderer = get_renderer(71.4, 42, 50.4, 25.2, 6.3, 19)
+    renderer.save_overlay(paths, 'all_paths.png')
+    renderer.export(paths, 'path_{:04d}.png')
+
+``paths`` are point lists or arrays as returned by ``generate_points``.
+Vector formats (SVG, PDF) cannot use the bitmap and draw the whole figure,
+but still reuse the specimen artists.
+"""
+import functools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from draw_based_on_models import PLOT_LIMIT, draw_specimen
+
+PATH_COLOR = 'g'
+# zlib level of PNG files; encoding at the default level takes far longer than drawing
+PNG_COMPRESS_LEVEL = 1
+
+
+def path_segments(points, width, length, x_limit=PLOT_LIMIT):
+    """(K, 2, 2) specimen-coordinate segments of a path after the initial crack, like path_coordinates."""
+    points = np.asarray(points, dtype=np.float64)
+    points = points[~np.isnan(points[:, 0])]
+    # A segment is drawn while its start lies within the plotting limit
+    beyond = np.flatnonzero(points[1:-1, 0] > x_limit)
+    end = beyond[0] + 1 if len(beyond) else len(points) - 1
+    specimen = np.column_stack([width - points[1:end + 1, 0], length / 2 + points[1:end + 1, 1]])
+    return np.stack([specimen[:-1], specimen[1:]], axis=1)
+
+
+class SpecimenRenderer:
+    """Renders crack paths onto a cached figure of one specimen geometry."""
+
+    def __init__(self, length, width, vertical_distance, horizontal_distance, diameter, precrack, method='DNN',
+                 dpi=120):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.length = length
+        self.width = width
+        self.figure = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        draw_specimen(length, width, vertical_distance, horizontal_distance, diameter, precrack, method, self.ax)
+        # The initial crack is the same for every path
+        self.ax.plot([width, width - precrack], [length / 2, length / 2], lw=2, c='k', solid_capstyle='round')
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def collection(self, paths, colors=PATH_COLOR, linewidth=1, alpha=None):
+        from matplotlib.collections import LineCollection
+
+        segments = [path_segments(points, self.width, self.length) for points in paths]
+        if not isinstance(colors, str):
+            # One color per path
+            colors = [color for color, part in zip(colors, segments) for _ in range(len(part))]
+        return LineCollection(np.concatenate(segments) if segments else np.empty((0, 2, 2)), colors=colors,
+                              linewidths=linewidth, alpha=alpha, capstyle='round')
+
+    def render(self, paths, colors=PATH_COLOR, linewidth=1, alpha=None):
+        """Draw ``paths`` over the cached specimen and return the image as an (H, W, 4) uint8 array."""
+        collection = self.collection(paths, colors, linewidth, alpha)
+        collection.set_animated(True)
+        self.ax.add_collection(collection, autolim=False)
+        try:
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(collection)
+            return np.array(self.canvas.buffer_rgba())
+        finally:
+            collection.remove()
+
+    def _write_png(self, image, file_name):
+        from PIL import Image
+
+        dpi = (self.figure.dpi, self.figure.dpi)
+        Image.fromarray(image[..., :3]).save(file_name, compress_level=PNG_COMPRESS_LEVEL, dpi=dpi)
+
+    def save(self, paths, file_name, colors=PATH_COLOR, linewidth=1, alpha=None):
+        """Write ``paths`` over the specimen to ``file_name``; the format follows the extension."""
+        if os.path.splitext(file_name)[1].lower() == '.png':
+            self._write_png(self.render(paths, colors, linewidth, alpha), file_name)
+            return
+        collection = self.collection(paths, colors, linewidth, alpha)
+        self.ax.add_collection(collection, autolim=False)
+        try:
+            self.figure.savefig(file_name)
+        finally:
+            collection.remove()
+
+    def save_overlay(self, paths, file_name, linewidth=0.5, alpha=0.3):
+        """All paths in one image, drawn thin and translucent so their density shows."""
+        self.save(paths, file_name, PATH_COLOR, linewidth, alpha)
+
+    def export(self, paths, name_pattern, linewidth=1, workers=4):
+        """Write every path to its own file named ``name_pattern.format(index)``; returns the file names.
+
+        Images are drawn one after the other, PNG files are encoded by
+        ``workers`` threads in the meantime. Only a few images are held in
+        memory at a time.
+        """
+        file_names = [name_pattern.format(index) for index in range(len(paths))]
+        if os.path.splitext(name_pattern)[1].lower() != '.png':
+            for points, file_name in zip(paths, file_names):
+                self.save([points], file_name, linewidth=linewidth)
+            return file_names
+        pending = deque()
+        with ThreadPoolExecutor(workers) as executor:
+            for points, file_name in zip(paths, file_names):
+                pending.append(executor.submit(self._write_png, self.render([points], linewidth=linewidth), file_name))
+                if len(pending) >= 2 * workers:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+        return file_names
+
+
+@functools.lru_cache(maxsize=8)
+def get_renderer(length, width, vertical_distance, horizontal_distance, diameter, precrack, method='DNN', dpi=120):
+    """The renderer of a geometry, created on first use and kept for the next calls."""
+    return SpecimenRenderer(length, width, vertical_distance, horizontal_distance, diameter, precrack, method, dpi)
@@ -0,0 +1,148 @@
+import json
+import os
+
+import numpy as np
+
+from model_registry import MODELS_DIR, compact_model_path, registry, resolve_version
+
+# Number of grid nodes along beta, theta, x/W and y/L; the angle model changes
+# quickly with beta and y/L, so these axes are refined most
+DEFAULT_SHAPE = (73, 19, 35, 49)
+
+
+def surrogate_path(kind, method, version=None):
+    if version is None:
+        version = resolve_version(kind, method)
+    return os.path.join(MODELS_DIR, f'surrogate_{kind}_{method}_ver{version}.npz')
+
+
+def training_bounds():
+    """Range of (beta, theta, x/W, y/L) covered by the training data."""
+    if os.path.exists(compact_model_path('angle')):
+        # Stored with the compact export, so the scaler need not be unpickled
+        with open(compact_model_path('angle')) as file:
+            scaler = json.load(file)['scaler_source']
+        return np.column_stack([scaler['data_min'], scaler['data_max']])
+    scaler = registry.get_scaler('DNN')
+    return np.column_stack([scaler.data_min_, scaler.data_max_])
+
+
+class SurrogateGrid:
+    """A model tabulated on a regular 4-D grid and evaluated by multilinear interpolation.
+
+    Queries outside the grid are clamped to its boundary. ``predict`` takes raw
+    (beta, theta, x/W, y/L) rows and returns an (N, 1) array like the models.
+    """
+
+    def __init__(self, axes, values, kind, method, version):
+        self.axes = [np.asarray(axis, dtype=np.float64) for axis in axes]
+        self.values = np.asarray(values, dtype=np.float32)
+        self.kind = kind
+        self.method = method
+        self.version = version
+        # Nodes of all axes in one table padded with inf, the largest lower node index of every axis and the
+        # offsets of the 16 corners of a grid cell in the flattened values (in the order of ``_weights``)
+        self._nodes = np.full((4, max(map(len, self.axes))), np.inf)
+        for dim, axis in enumerate(self.axes):
+            self._nodes[dim, :len(axis)] = axis
+        self._last_cell = np.array(self.values.shape) - 2
+        corners = np.stack(np.meshgrid(*[(0, 1)] * 4, indexing='ij'), axis=-1).reshape(16, 4)
+        self._corner_offsets = np.ravel_multi_index(corners.T, self.values.shape)
+
+    @classmethod
+    def tabulate(cls, kind, method='DNN', version=None, shape=DEFAULT_SHAPE, bounds=None, backend='keras',
+                 chunk_size=65536):
+        from predictions_based_on_models import predict_rows
+
+        if version is None:
+            version = resolve_version(kind, method)
+        bounds = training_bounds() if bounds is None else np.asarray(bounds, dtype=np.float64)
+        axes = [np.linspace(low, high, n) for (low, high), n in zip(bounds, shape)]
+        nodes = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 4)
+        values = predict_rows(kind, method, nodes, version, chunk_size, backend)
+        return cls(axes, values.reshape(shape), kind, method, version)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            axes = [data[f'axis_{i}'] for i in range(4)]
+            return cls(axes, data['values'], str(data['kind']), str(data['method']), int(data['version']))
+
+    def save(self, path):
+        np.savez_compressed(path, values=self.values, kind=self.kind, method=self.method, version=self.version,
+                            **{f'axis_{i}': axis for i, axis in enumerate(self.axes)})
+
+    def predict(self, data_array):
+        data_array = np.asarray(data_array, dtype=np.float64).reshape(-1, 4)
+        lower = np.empty(data_array.shape, dtype=np.intp)
+        for dim, axis in enumerate(self.axes):
+            lower[:, dim] = np.searchsorted(axis, data_array[:, dim])
+        lower = np.minimum(np.maximum(lower - 1, 0), self._last_cell)
+        low, high = self._nodes[np.arange(4), lower], self._nodes[np.arange(4), lower + 1]
+        fraction = np.minimum(np.maximum((data_array - low) / (high - low), 0), 1)
+
+        # Weighted sum over the 16 corners of the enclosing grid cell, gathered at once from the flat table
+        index = np.ravel_multi_index(lower.T, self.values.shape)[:, None] + self._corner_offsets
+        return np.einsum('ij,ij->i', self._weights(fraction), self.values.ravel()[index]).reshape(-1, 1)
+
+    @staticmethod
+    def _weights(fraction):
+        """Multilinear weights of the 16 cell corners, the first axis varying slowest; an (N, 16) array."""
+        pairs = np.stack([1 - fraction, fraction], axis=-1)
+        weights = pairs[:, 0]
+        for dim in range(1, 4):
+            weights = (weights[:, :, None] * pairs[:, dim, None, :]).reshape(len(fraction), 2 ** (dim + 1))
+        return weights
+
+
+def get_surrogate(kind, method, version=None):
+    path = surrogate_path(kind, method, version)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No surrogate grid for {kind}/{method}; create it with '
+                                f'"python -m cts tabulate {kind} --method {method}"')
+    return registry.get(path, lambda: SurrogateGrid.load(path), os.path.getsize(path))
+
+
+def path_points(n_paths=200, seed=0, width=42, length=71.4, method='DNN', backend='keras'):
+    """Model inputs met along crack paths with random theta, initial crack length and increment."""
+    from draw_based_on_models import generate_points_batch
+
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0, 90, n_paths)
+    p2 = np.column_stack([rng.uniform(15, 23, n_paths), np.zeros(n_paths)])
+    points, _, _ = generate_points_batch((0, 0), p2, theta, width, length, rng.uniform(0.5, 3, n_paths), method,
+                                         backend, max_steps=200)
+    previous, last = points[:, :-2], points[:, 1:-1]
+    angle_of_last_part = np.arctan2(last[..., 1] - previous[..., 1], last[..., 0] - previous[..., 0])
+    data_array = np.stack([90 - np.abs(np.degrees(angle_of_last_part)),
+                           np.broadcast_to(theta[:, None], angle_of_last_part.shape),
+                           last[..., 0] / width, last[..., 1] / length], axis=-1)
+    return data_array[~np.isnan(points[:, 2:, 0])]
+
+
+def validate(grid, n_points=10000, seed=0, backend='keras'):
+    """Compare a surrogate grid with its model on held-out points.
+
+    ``box`` uses points drawn uniformly from the whole grid, ``paths`` the
+    inputs met along random crack paths (restricted to the grid range). The
+    training data does not fill the whole box, so ``box`` errors are dominated
+    by corners that crack paths never reach.
+    """
+    from predictions_based_on_models import predict_rows
+
+    rng = np.random.default_rng(seed)
+    low = np.array([axis[0] for axis in grid.axes])
+    high = np.array([axis[-1] for axis in grid.axes])
+    along_paths = path_points(seed=seed, method=grid.method, backend=backend)
+    along_paths = along_paths[np.all((along_paths >= low) & (along_paths <= high), axis=1)][:n_points]
+    report = {}
+    for name, data_array in [('box', rng.uniform(low, high, size=(n_points, 4))), ('paths', along_paths)]:
+        expected = predict_rows(grid.kind, grid.method, data_array, grid.version, backend=backend)
+        errors = grid.predict(data_array)[:, 0] - expected
+        report[name] = {
+            'n_points': len(data_array),
+            'max_error': float(np.max(np.abs(errors))),
+            'rms_error': float(np.sqrt(np.mean(errors ** 2))),
+            'output_range': float(np.ptp(expected)),
+        }
+    return report
@@ -0,0 +1,200 @@
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+from draw_based_on_models import StopConditions, fracture_history_batch, generate_points_batch
+from model_registry import KINDS, preload
+from worker_pool import map_bounded
+
+# Geometry and load inputs of one sweep case, in the order of the crack path screen;
+# paths stop at the pin holes of their geometry
+CASE_COLUMNS = ('length', 'width', 'vertical_distance', 'horizontal_distance', 'diameter', 'precrack', 'theta',
+                'increment')
+DEFAULTS = {
+    'length': 71.4,
+    'width': 42,
+    'vertical_distance': 50.4,
+    'horizontal_distance': 25.2,
+    'diameter': 6.3,
+    'precrack': 19,
+    'theta': 45,
+    'increment': 2,
+    'method': 'DNN',
+}
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def build_grid(**values):
+    """Return the cartesian product of the given values as a dict of column arrays.
+
+    Every input not given keeps its default from the crack path screen, e.g.
+    ``build_grid(theta=range(0, 91, 5), increment=[0.5, 1, 2])``.
+    """
+    names = list(DEFAULTS)
+    axes = [np.atleast_1d(values.pop(name, DEFAULTS[name])) for name in names]
+    if values:
+        raise ValueError(f'Unknown sweep inputs: {", ".join(values)}')
+    rows = list(itertools.product(*axes))
+    return {name: np.array([row[i] for row in rows]) for i, name in enumerate(names)}
+
+
+def _as_columns(cases):
+    if isinstance(cases, dict):
+        n_cases = len(next(iter(cases.values())))
+        columns = {name: np.asarray(cases.get(name, [DEFAULTS[name]] * n_cases)) for name in DEFAULTS}
+    else:
+        cases = list(cases)
+        columns = {name: np.array([case.get(name, DEFAULTS[name]) for case in cases]) for name in DEFAULTS}
+    for name in CASE_COLUMNS:
+        columns[name] = columns[name].astype(np.float64)
+    columns['method'] = columns['method'].astype(str)
+    return columns
+
+
+def _preload(methods, kinds, backend):
+    for method in methods:
+        preload(('angle', *kinds), method, backend)
+
+
+def _run_chunk(chunk_index, columns, backend, max_steps, kinds):
+    n_cases = len(columns['theta'])
+    # Cases sharing a method and pin geometry grow in lockstep with the same stop conditions
+    groups = {}
+    for index, key in enumerate(zip(columns['method'], columns['vertical_distance'],
+                                    columns['horizontal_distance'], columns['diameter'])):
+        groups.setdefault(key, []).append(index)
+    results = []
+    for (method, vertical_distance, horizontal_distance, diameter), idx in groups.items():
+        idx = np.array(idx)
+        stop = StopConditions(vertical_distance, horizontal_distance, diameter, max_steps=max_steps)
+        p2 = np.column_stack([columns['precrack'][idx], np.zeros(len(idx))])
+        theta, width, length = columns['theta'][idx], columns['width'][idx], columns['length'][idx]
+        points, lengths, reasons = generate_points_batch((0, 0), p2, theta, width, length,
+                                                         columns['increment'][idx], method, backend, stop=stop)
+        history = {}
+        if kinds:
+            history = fracture_history_batch(points, lengths, theta, width, length, method, kinds, backend)
+        results.append((idx, points, lengths, reasons, history))
+
+    n_steps = max(points.shape[1] for _, points, _, _, _ in results)
+    chunk = {
+        'points': np.full((n_cases, n_steps, 2), np.nan),
+        'lengths': np.zeros(n_cases, dtype=np.int64),
+        'reason': np.empty(n_cases, dtype=object),
+    }
+    for name in history:
+        chunk[name] = np.full((n_cases, n_steps), np.nan)
+    for idx, points, lengths, reasons, history in results:
+        chunk['points'][idx, :points.shape[1]] = points
+        chunk['lengths'][idx] = lengths
+        chunk['reason'][idx] = reasons
+        for name, values in history.items():
+            chunk[name][idx, :values.shape[1]] = values
+    chunk['reason'] = chunk['reason'].astype(str)
+    return chunk_index, chunk
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def _sweep_hash(columns, settings):
+    """Fingerprint of the cases and of the settings that change their results."""
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for name in (*CASE_COLUMNS, 'method'):
+        digest.update(name.encode())
+        digest.update('\0'.join(columns[name]).encode() if name == 'method' else columns[name].tobytes())
+    return digest.hexdigest()
+
+
+def _read_checkpoint(output_dir, checkpoint):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        stored = json.load(file)
+    if any(stored.get(key) != checkpoint[key] for key in ('n_cases', 'chunk_size', 'sweep_hash')):
+        raise ValueError(f'{output_dir} holds a different sweep; use another output directory or resume=False')
+    return set(stored['completed'])
+
+
+def run_sweep(cases, output_dir, backend='keras', chunk_size=256, workers=None, max_steps=None, resume=True,
+              kinds=()):
+    """Generate crack paths for many sweep cases on a process pool.
+
+    ``cases`` is a dict of column arrays (e.g. from ``build_grid``) or a list of
+    dicts with the keys of ``DEFAULTS``. Cases are split into chunks of
+    ``chunk_size`` that are written to ``output_dir/chunk_<n>.npz`` as soon as
+    they finish; only a few chunks are in flight at a time, so memory does
+    not grow with the sweep. Paths stop when they leave the specimen, reach
+    a pin hole or after ``max_steps``, and the reason is stored with them.
+    ``kinds`` (e.g. ``HISTORY_KINDS``) adds the crack extension and these
+    fracture parameters at every crack-tip position of every path.
+
+    A checkpoint file records the finished chunks and a hash of the cases
+    and settings, so an interrupted sweep continues where it stopped when
+    run again with ``resume=True``; a different sweep in the same directory
+    is refused. ``workers=0`` runs everything in the calling process.
+    Returns the number of chunks computed by this call.
+    """
+    columns = _as_columns(cases)
+    n_cases = len(columns['theta'])
+    kinds = tuple(kinds)
+    checkpoint = {
+        'n_cases': n_cases,
+        'chunk_size': chunk_size,
+        'sweep_hash': _sweep_hash(columns, {'backend': backend, 'max_steps': max_steps, 'kinds': kinds}),
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    completed = _read_checkpoint(output_dir, checkpoint) if resume else set()
+    chunks = [(index, {name: values[start:start + chunk_size] for name, values in columns.items()})
+              for index, start in enumerate(range(0, n_cases, chunk_size)) if index not in completed]
+
+    def save(result):
+        chunk_index, results = result
+        chunk_columns = {name: values[chunk_index * chunk_size:(chunk_index + 1) * chunk_size]
+                         for name, values in columns.items()}
+        case = np.arange(chunk_index * chunk_size, chunk_index * chunk_size + len(results['lengths']))
+        path = os.path.join(output_dir, f'chunk_{chunk_index:05d}.npz')
+        with open(f'{path}.tmp', 'wb') as file:
+            np.savez(file, case=case, **results, **chunk_columns)
+        os.replace(f'{path}.tmp', path)
+        completed.add(chunk_index)
+        _write_json(os.path.join(output_dir, CHECKPOINT_FILE), {**checkpoint, 'completed': sorted(completed)})
+
+    methods = list(np.unique(columns['method']))
+    map_bounded(_run_chunk, [(chunk_index, chunk_columns, backend, max_steps, kinds)
+                             for chunk_index, chunk_columns in chunks],
+                workers, _preload, (methods, kinds, backend), save)
+    return len(chunks)
+
+
+def load_sweep(output_dir):
+    """Read the chunks of a sweep back as a dict of columns ordered by case.
+
+    ``points`` is a list with one (n, 2) array of crack path points per case,
+    and so are the crack extension and fracture parameters if the sweep
+    computed them, with one value per point.
+    """
+    files = sorted(name for name in os.listdir(output_dir) if name.startswith('chunk_') and name.endswith('.npz'))
+    parts = {}
+    paths = {}
+    for name in files:
+        with np.load(os.path.join(output_dir, name)) as chunk:
+            for key in chunk.files:
+                if key in ('points', 'extension', *KINDS):
+                    paths.setdefault(key, []).extend(values[:n] for values, n in zip(chunk[key], chunk['lengths']))
+                else:
+                    parts.setdefault(key, []).append(chunk[key])
+    results = {key: np.concatenate(values) for key, values in parts.items()}
+    order = np.argsort(results['case'], kind='stable')
+    results = {key: values[order] for key, values in results.items()}
+    for key, values in paths.items():
+        results[key] = [values[i] for i in order]
+    return results
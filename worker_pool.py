@@ -0,0 +1,31 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_bounded(function, arguments, workers=None, initializer=None, initargs=(), consume=None):
+    """Call ``function(*args)`` for every tuple of ``arguments`` in worker processes.
+
+    Every result is passed to ``consume`` in the order of ``arguments``. Only
+    two calls per worker are in flight at a time, so ``arguments`` can be a
+    generator and finished results are not kept until the end; because they
+    are consumed in order, running sums are identical for any number of
+    workers. ``initializer(*initargs)`` runs once in every worker (for
+    example ``model_registry.preload``). ``workers`` defaults to the number
+    of CPUs; ``workers=0`` runs everything in the calling process.
+    """
+    if workers == 0:
+        if initializer is not None:
+            initializer(*initargs)
+        for args in arguments:
+            consume(function(*args))
+        return
+    n_workers = workers or os.cpu_count() or 1
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer, initargs=initargs) as executor:
+        for args in arguments:
+            pending.append(executor.submit(function, *args))
+            if len(pending) >= 2 * n_workers:
+                consume(pending.popleft().result())
+        while pending:
+            consume(pending.popleft().result())